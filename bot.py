@@ -1,9 +1,19 @@
 import os
+import sys
+import time
 import logging
 import asyncio
 import random
+import functools
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict, deque
 from datetime import datetime, timedelta
-from threading import Thread
+from threading import Thread, Event, get_ident
+
+# Reference point for the startup timeline
+process_started = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(
@@ -12,7 +22,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from pyrogram import Client, filters, idle
+from pyrogram import Client, filters, idle, enums
+from pyrogram.errors import FloodWait, MessageNotModified
 from pyrogram.types import (
     Message,
     CallbackQuery,
@@ -21,8 +32,9 @@ from pyrogram.types import (
     User,
 )
 
-from pymongo import MongoClient
-from flask import Flask, jsonify # Import Flask and jsonify
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING, ReadPreference, WriteConcern, monitoring
+from pymongo.errors import DuplicateKeyError
+from bson import json_util
 
 # Configuration
 API_ID = int(os.getenv("API_ID", 0))
@@ -33,6 +45,79 @@ ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", 0))
 CONTENT_CHANNEL_ID = int(os.getenv("CONTENT_CHANNEL_ID", 0))
 LOG_CHANNEL_ID = int(os.getenv("LOG_CHANNEL_ID", 0))
 
+# Profiling settings (used only while /profile is running)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 300))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", 15))
+
+# Log channel digest settings
+LOG_DIGEST_INTERVAL = int(os.getenv("LOG_DIGEST_INTERVAL", 60))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 1000))
+LOG_DIGEST_SAMPLE = int(os.getenv("LOG_DIGEST_SAMPLE", 10))
+
+# Group registry settings
+GROUP_LAST_SEEN_INTERVAL = int(os.getenv("GROUP_LAST_SEEN_INTERVAL", 3600))
+GROUP_FLUSH_INTERVAL = int(os.getenv("GROUP_FLUSH_INTERVAL", 30))
+
+# Score event log settings
+SCORE_EVENT_BATCH_SIZE = int(os.getenv("SCORE_EVENT_BATCH_SIZE", 100))
+SCORE_EVENT_FLUSH_INTERVAL = int(os.getenv("SCORE_EVENT_FLUSH_INTERVAL", 5))
+SCORE_EVENT_RETENTION_DAYS = int(os.getenv("SCORE_EVENT_RETENTION_DAYS", 90))
+SCORE_EVENT_CONSUMERS = os.getenv("SCORE_EVENT_CONSUMERS", "").lower() in ("1", "true", "yes")
+SCORE_CONSUMER_CHECKPOINT_EVERY = int(os.getenv("SCORE_CONSUMER_CHECKPOINT_EVERY", 50))
+SCORE_CONSUMER_JOIN_TIMEOUT = float(os.getenv("SCORE_CONSUMER_JOIN_TIMEOUT", 5))
+
+# Lobby settings
+LOBBY_EDIT_INTERVAL = float(os.getenv("LOBBY_EDIT_INTERVAL", 3))
+LOBBY_MAX_PLAYERS = int(os.getenv("LOBBY_MAX_PLAYERS", 200))
+LOBBY_ROSTER_PREVIEW = int(os.getenv("LOBBY_ROSTER_PREVIEW", 30))
+
+# Content cache settings
+CONTENT_CACHE_TTL = int(os.getenv("CONTENT_CACHE_TTL", 600))
+CONTENT_GAME_TYPES = ["quiz", "wordchain", "guessing"]
+
+# Answer throttling settings (token bucket per chat and player)
+ANSWER_RATE = float(os.getenv("ANSWER_RATE", 1))
+ANSWER_BURST = float(os.getenv("ANSWER_BURST", 5))
+REPLY_COALESCE_WINDOW = float(os.getenv("REPLY_COALESCE_WINDOW", 3))
+GAME_SAVE_DEBOUNCE = float(os.getenv("GAME_SAVE_DEBOUNCE", 2))
+THROTTLE_PRUNE_INTERVAL = float(os.getenv("THROTTLE_PRUNE_INTERVAL", 60))
+
+# Trace recording settings (recording is off unless TRACE_DIR is set)
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024))
+TRACE_MAX_FILES = int(os.getenv("TRACE_MAX_FILES", 5))
+TRACE_SALT = os.getenv("TRACE_SALT", "") or os.urandom(16).hex()
+
+# Shutdown settings
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 10))
+
+# Quiz round settings
+QUIZ_ROUNDS = int(os.getenv("QUIZ_ROUNDS", 10))
+QUIZ_ROUND_SECONDS = int(os.getenv("QUIZ_ROUND_SECONDS", 20))
+QUIZ_ADVANCE_DELAY = int(os.getenv("QUIZ_ADVANCE_DELAY", 2))
+
+# Game state backend: "mongo" (default), "redis" or "memory"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "mongo").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "gamebot")
+
+# MongoDB connection settings
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+MONGO_WRITE_TIMEOUT_MS = int(os.getenv("MONGO_WRITE_TIMEOUT_MS", 5000))
+MONGO_RETRY_WRITES = os.getenv("MONGO_RETRY_WRITES", "true").lower() in ("1", "true", "yes")
+MONGO_RETRY_READS = os.getenv("MONGO_RETRY_READS", "true").lower() in ("1", "true", "yes")
+# Per operation class: scores are worth waiting for, game checkpoints are overwritten constantly
+MONGO_SCORE_WRITE_CONCERN = os.getenv("MONGO_SCORE_WRITE_CONCERN", "majority")
+MONGO_CHECKPOINT_WRITE_CONCERN = os.getenv("MONGO_CHECKPOINT_WRITE_CONCERN", "1")
+MONGO_LEADERBOARD_READ_PREFERENCE = os.getenv("MONGO_LEADERBOARD_READ_PREFERENCE", "secondaryPreferred")
+
 DB_NAME = "telegram_games_db"
 
 # Initialize Pyrogram Client
@@ -43,40 +128,392 @@ app = Client(
     bot_token=BOT_TOKEN
 )
 
-# Initialize Flask app for health check
-flask_app = Flask(__name__) # Keep this at the top level
+# Flask app for health check, built in the server thread so importing Flask
+# stays off the startup path
+def create_flask_app():
+    from flask import Flask, jsonify
+
+    flask_app = Flask(__name__)
+
+    # Flask routes for health check ONLY
+    @flask_app.route('/')
+    def home():
+        return "Bot is running!"
+
+    @flask_app.route('/healthz')
+    def health_check():
+        return jsonify({"status": "healthy"}), 200
 
-# Flask routes for health check ONLY
-@flask_app.route('/')
-def home():
-    return "Bot is running!"
+    @flask_app.route('/stats')
+    def stats():
+        return jsonify({
+            "log_forwarder": log_forwarder_stats,
+            "group_registry": group_registry_stats,
+            "score_events": score_event_stats,
+            "mongo_pool": mongo_pool_metrics.snapshot(),
+            "startup": startup_timeline,
+            "answer_throttle": throttle_stats,
+        }), 200
 
-@flask_app.route('/healthz')
-def health_check():
-    return jsonify({"status": "healthy"}), 200
+    return flask_app
 
 # MongoDB setup
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage so saturation shows up in /stats"""
+
+    def __init__(self):
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.pool_clears = 0
+
+    def snapshot(self):
+        return {
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+            "saturation": round(self.checked_out / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else None,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "connections_created": self.connections_created,
+            "connections_closed": self.connections_closed,
+            "pool_clears": self.pool_clears,
+        }
+
+    def connection_checked_out(self, event):
+        self.checkouts += 1
+        self.checked_out += 1
+        self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+        logger.warning(f"MongoDB connection checkout failed: {event.reason}")
+
+    def connection_created(self, event):
+        self.connections_created += 1
+
+    def connection_closed(self, event):
+        self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+mongo_pool_metrics = PoolMetrics()
+
+def _write_concern(value: str):
+    """Build a write concern from a w value (e.g. majority or 1)"""
+    return WriteConcern(w=int(value) if value.isdigit() else value, wtimeout=MONGO_WRITE_TIMEOUT_MS)
+
 mongo_client = None
 db = None
 users_collection = None
+leaderboard_users_collection = None
+leaderboard_buckets_collection = None
 groups_collection = None
 game_states_collection = None
 channel_content_cache_collection = None
+score_buckets_collection = None
+score_events_collection = None
+stream_offsets_collection = None
+game_type_stats_collection = None
+group_activity_collection = None
 
 def init_mongo():
-    global mongo_client, db, users_collection, groups_collection, game_states_collection, channel_content_cache_collection
+    global mongo_client, db, users_collection, groups_collection, game_states_collection, channel_content_cache_collection, score_buckets_collection
+    global score_events_collection, stream_offsets_collection, game_type_stats_collection, group_activity_collection
+    global leaderboard_users_collection, leaderboard_buckets_collection, mongo_ready
     try:
-        mongo_client = MongoClient(MONGO_URI)
+        mongo_client = MongoClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            retryWrites=MONGO_RETRY_WRITES,
+            retryReads=MONGO_RETRY_READS,
+            event_listeners=[mongo_pool_metrics]
+        )
+        # pymongo connects lazily, so ping now to fail fast on an unreachable server
+        mongo_client.admin.command("ping")
         db = mongo_client[DB_NAME]
-        users_collection = db["users"]
+
+        score_write_concern = _write_concern(MONGO_SCORE_WRITE_CONCERN)
+        leaderboard_read_preference = READ_PREFERENCES[MONGO_LEADERBOARD_READ_PREFERENCE]
+        users_collection = db.get_collection("users", write_concern=score_write_concern)
         groups_collection = db["groups"]
-        game_states_collection = db["game_states"]
+        game_states_collection = db.get_collection(
+            "game_states", write_concern=_write_concern(MONGO_CHECKPOINT_WRITE_CONCERN)
+        )
         channel_content_cache_collection = db["channel_content_cache"]
+        score_buckets_collection = db.get_collection("score_buckets", write_concern=score_write_concern)
+        leaderboard_users_collection = db.get_collection("users", read_preference=leaderboard_read_preference)
+        leaderboard_buckets_collection = db.get_collection("score_buckets", read_preference=leaderboard_read_preference)
+        score_events_collection = db.get_collection("score_events", write_concern=score_write_concern)
+        stream_offsets_collection = db["stream_offsets"]
+        game_type_stats_collection = db["game_type_stats"]
+        group_activity_collection = db["group_activity"]
+        ensure_score_bucket_indexes()
+        score_events_collection.create_index("ts", expireAfterSeconds=SCORE_EVENT_RETENTION_DAYS * 86400)
+        mongo_ready = True
         logger.info("MongoDB initialized successfully")
     except Exception as e:
         logger.critical(f"MongoDB connection failed: {e}")
         raise
 
+# Time-bucketed score counters backing the daily/weekly leaderboards.
+# Each bucket expires through a TTL index once its retention has passed.
+SCORE_BUCKET_RETENTION = {
+    "hour": timedelta(days=2),
+    "day": timedelta(days=35),
+    "week": timedelta(weeks=16),
+}
+LEADERBOARD_WINDOWS = {"daily": "day", "weekly": "week"}
+GLOBAL_SCOPE = 0  # group_id used for global buckets
+
+def ensure_score_bucket_indexes():
+    score_buckets_collection.create_index(
+        [("window", ASCENDING), ("bucket", ASCENDING), ("group_id", ASCENDING), ("user_id", ASCENDING)],
+        unique=True
+    )
+    score_buckets_collection.create_index(
+        [("window", ASCENDING), ("bucket", ASCENDING), ("group_id", ASCENDING), ("score", DESCENDING)]
+    )
+    score_buckets_collection.create_index("expires_at", expireAfterSeconds=0)
+
+def score_bucket(window: str, when: datetime):
+    """Return the bucket id a timestamp falls into for a window"""
+    if window == "hour":
+        return when.strftime("%Y-%m-%dT%H")
+    if window == "day":
+        return when.strftime("%Y-%m-%d")
+    year, week, _ = when.isocalendar()
+    return f"{year}-W{week:02d}"
+
+# Game state stores
+# Live sessions (with their timer tasks) always sit in active_games; a store
+# holds the serializable snapshots used to resume or share them.
+class GameStateStore(ABC):
+    """Interface for game state snapshot backends"""
+
+    @abstractmethod
+    async def save(self, game_key: tuple, game_state: dict, background: bool = False):
+        pass
+
+    async def save_many(self, game_states: dict):
+        """Save {game_key: game_state} in as few round trips as the backend allows"""
+        for game_key, game_state in game_states.items():
+            await self.save(game_key, game_state)
+
+    @abstractmethod
+    async def delete(self, game_key: tuple):
+        pass
+
+    @abstractmethod
+    async def load_all(self):
+        """Return {game_key: game_state} for every stored game"""
+
+    async def close(self):
+        pass
+
+class MemoryStateStore(GameStateStore):
+    """Keeps snapshots in process memory (local runs and tests)"""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    async def save(self, game_key: tuple, game_state: dict, background: bool = False):
+        self.snapshots[game_key] = game_state
+
+    async def delete(self, game_key: tuple):
+        self.snapshots.pop(game_key, None)
+
+    async def load_all(self):
+        return {game_key: dict(game_state) for game_key, game_state in self.snapshots.items()}
+
+class MongoStateStore(GameStateStore):
+    """Mirrors snapshots to the game_states collection"""
+
+    async def save(self, game_key: tuple, game_state: dict, background: bool = False):
+        if game_states_collection is None:
+            return
+
+        write = lambda: game_states_collection.update_one(
+            {"_id": game_doc_id(game_key)},
+            {"$set": game_state},
+            upsert=True
+        )
+        if background:
+            await asyncio.to_thread(write)
+        else:
+            write()
+
+    async def save_many(self, game_states: dict):
+        if game_states_collection is None or not game_states:
+            return
+
+        game_states_collection.bulk_write([
+            UpdateOne({"_id": game_doc_id(game_key)}, {"$set": game_state}, upsert=True)
+            for game_key, game_state in game_states.items()
+        ], ordered=False)
+
+    async def delete(self, game_key: tuple):
+        if game_states_collection is not None:
+            game_states_collection.delete_one({"_id": game_doc_id(game_key)})
+
+    async def load_all(self):
+        # Runs while the bot is already serving, so keep the scan off the event loop
+        return await asyncio.to_thread(self._load_all)
+
+    def _load_all(self):
+        if game_states_collection is None:
+            return {}
+
+        games = {}
+        legacy_ids = []
+        for doc in game_states_collection.find():
+            doc_id = doc.pop("_id")
+            if isinstance(doc_id, dict):
+                game_key = (doc_id["chat_id"], doc_id["thread_id"], doc_id["game_id"])
+            else:
+                # Documents from before multi-game support were keyed by chat id only
+                game_key = (doc_id, 0, "legacy")
+                legacy_ids.append(doc_id)
+            games[game_key] = doc
+
+        for chat_id in legacy_ids:
+            game_states_collection.update_one(
+                {"_id": game_doc_id((chat_id, 0, "legacy"))},
+                {"$set": games[(chat_id, 0, "legacy")]},
+                upsert=True
+            )
+            game_states_collection.delete_one({"_id": chat_id})
+        return games
+
+class RedisStateStore(GameStateStore):
+    """Stores each game as a Redis hash with one JSON-encoded field per state key.
+
+    Only fields that changed since the last write are sent, and each save or
+    delete is a single pipelined round trip. The client must be a
+    redis.asyncio-compatible client created with decode_responses=True
+    (fakeredis.aioredis.FakeRedis works for local testing).
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.index_key = f"{REDIS_KEY_PREFIX}:games"
+        self.written = {}
+
+    def _key(self, game_key: tuple):
+        chat_id, thread_id, game_id = game_key
+        return f"{REDIS_KEY_PREFIX}:game:{chat_id}:{thread_id}:{game_id}"
+
+    def _queue_save(self, pipe, game_key: tuple, game_state: dict):
+        """Queue the changed fields of one game on a pipeline; return the encoded state"""
+        encoded = {field: json_util.dumps(value) for field, value in game_state.items()}
+        previous = self.written.get(game_key, {})
+        changed = {field: value for field, value in encoded.items() if previous.get(field) != value}
+        removed = [field for field in previous if field not in encoded]
+        if not changed and not removed:
+            return None
+
+        key = self._key(game_key)
+        if changed:
+            pipe.hset(key, mapping=changed)
+        if removed:
+            pipe.hdel(key, *removed)
+        pipe.sadd(self.index_key, key)
+        return encoded
+
+    async def save(self, game_key: tuple, game_state: dict, background: bool = False):
+        await self.save_many({game_key: game_state})
+
+    async def save_many(self, game_states: dict):
+        pipe = self.client.pipeline(transaction=False)
+        queued = {}
+        for game_key, game_state in game_states.items():
+            encoded = self._queue_save(pipe, game_key, game_state)
+            if encoded is not None:
+                queued[game_key] = encoded
+        if not queued:
+            return
+
+        await pipe.execute()
+        self.written.update(queued)
+
+    async def delete(self, game_key: tuple):
+        key = self._key(game_key)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(key)
+        pipe.srem(self.index_key, key)
+        await pipe.execute()
+        self.written.pop(game_key, None)
+
+    async def load_all(self):
+        keys = list(await self.client.smembers(self.index_key))
+        if not keys:
+            return {}
+
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        hashes = await pipe.execute()
+
+        games = {}
+        for key, fields in zip(keys, hashes):
+            if not fields:
+                continue
+            chat_id, thread_id, game_id = key.rsplit(":", 3)[1:]
+            game_key = (int(chat_id), int(thread_id), game_id)
+            games[game_key] = {field: json_util.loads(value) for field, value in fields.items()}
+            self.written[game_key] = dict(fields)
+        return games
+
+    async def close(self):
+        await self.client.aclose()
+
+state_store = None
+
+def init_state_store():
+    global state_store
+    if STATE_BACKEND == "redis":
+        import redis.asyncio as redis_asyncio
+        state_store = RedisStateStore(redis_asyncio.from_url(REDIS_URL, decode_responses=True))
+    elif STATE_BACKEND == "memory":
+        state_store = MemoryStateStore()
+    else:
+        state_store = MongoStateStore()
+    logger.info(f"Game state store: {type(state_store).__name__}")
+
 # Game constants
 GAME_QUIZ = "Quiz / Trivia"
 GAME_WORDCHAIN = "Shabd Shrinkhala"
@@ -90,54 +527,149 @@ GAMES_LIST = [
     (GAME_NUMBER_GUESSING, "number_guessing")
 ]
 
+# Game sessions keyed by (chat_id, thread_id, game_id); thread_id is 0 outside forum topics
 active_games = {}
+# Secondary index (chat_id, thread_id) -> game key, used to route answers in O(1)
+topic_games = {}
+
+# Startup/shutdown state: new games are refused until interrupted games are
+# resumed, and every update is dropped once draining for shutdown has started
+games_resumed = False
+draining = False
+# Pyrogram can start dispatching before init_mongo finishes; Mongo-backed
+# commands check this instead of reporting missing data
+mongo_ready = False
+inflight_handlers = 0
+startup_timeline = []
+
+# Answer throttling state
+answer_buckets = {}  # (chat_id, user_id) -> [tokens, last refill]
+recent_replies = {}  # game_key -> {(user_id, text): last sent}
+pending_saves = {}  # game_key -> debounced save task
+throttle_stats = {"allowed": 0, "dropped": 0, "coalesced_replies": 0, "deferred_saves": 0}
+
+# Per-game asyncio tasks; never persisted
+RUNTIME_FIELDS = ("timer_task", "inactivity_task")
+LOBBY_COUNTDOWN_SECONDS = 60
+
+# Channel content per game type: game type -> (loaded at, items)
+content_cache = {}
+
+# Open lobbies: game key -> {"members": set of user ids, "task": pending edit, "last_edit": monotonic time}
+lobbies = {}
+
+# Set by the answer handler so the quiz round loop can advance early
+quiz_round_events = {}
+
+# Log forwarder state: bounded queue of (kind, name) events, oldest dropped first
+LOG_EVENT_LABELS = {
+    "new_user": "New users",
+    "group_add": "Bot added to groups",
+}
+log_events = deque(maxlen=LOG_QUEUE_SIZE)
+log_forwarder_stats = {"queued": 0, "dropped": 0, "sent": 0, "failed": 0, "digests": 0}
+
+# Group registry: cached group fields, only changed or stale entries get written
+group_registry = {}
+dirty_groups = set()
+group_registry_stats = {"touches": 0, "writes": 0, "flushes": 0}
+
+# Score event log: events are buffered here and inserted in batches
+score_event_buffer = []
+score_flush_tasks = set()  # batch flushes started from the answer path
+score_event_stats = {"buffered": 0, "written": 0, "failed": 0, "consumed": 0, "replayed": 0}
 
 # Helper functions
 async def get_channel_content(game_type: str):
-    """Fetch content for a specific game type from MongoDB"""
+    """Fetch content for a specific game type, cached for CONTENT_CACHE_TTL seconds"""
+    cached = content_cache.get(game_type)
+    if cached and time.monotonic() - cached[0] < CONTENT_CACHE_TTL:
+        return cached[1]
+
     # Corrected check: compare with None
     if channel_content_cache_collection is None:
         logger.error("Channel content collection not initialized")
         return []
 
     try:
-        content = list(channel_content_cache_collection.find({"game_type": game_type}))
+        content = await asyncio.to_thread(
+            lambda: list(channel_content_cache_collection.find({"game_type": game_type}))
+        )
         if not content:
             logger.warning(f"No content found for game type: {game_type}")
+        else:
+            content_cache[game_type] = (time.monotonic(), content)
         return content
     except Exception as e:
         logger.error(f"Error fetching content: {e}")
         return []
 
-async def update_user_score(user_id: int, username: str, group_id: int, points: int):
+async def update_user_score(user_id: int, username: str, group_id: int, points: int, game_type: str = None):
     """Update user score in MongoDB"""
     # Corrected check: compare with None
     if users_collection is None:
         logger.error("Users collection not initialized")
         return
 
+    now = datetime.utcnow()
+    record_score_event(user_id, group_id, game_type, points, now)
     try:
-        users_collection.update_one(
+        # Off the event loop: with a majority write concern this waits on replication
+        await asyncio.to_thread(
+            users_collection.update_one,
             {"user_id": user_id},
             {"$inc": {"total_score": points, f"group_scores.{group_id}": points},
-             "$set": {"username": username, "last_updated": datetime.utcnow()}},
+             "$set": {"username": username, "last_updated": now}},
             upsert=True
         )
         logger.info(f"Updated score for user {username} ({user_id})")
     except Exception as e:
         logger.error(f"Error updating score: {e}")
 
-async def get_leaderboard(group_id: int = None):
-    """Fetch leaderboard from MongoDB"""
+    if score_buckets_collection is None:
+        return
+
+    operations = []
+    for window, retention in SCORE_BUCKET_RETENTION.items():
+        for scope in (group_id, GLOBAL_SCOPE):
+            operations.append(UpdateOne(
+                {"window": window, "bucket": score_bucket(window, now), "group_id": scope, "user_id": user_id},
+                {"$inc": {"score": points},
+                 "$set": {"username": username},
+                 "$max": {"expires_at": now + retention}},
+                upsert=True
+            ))
+    try:
+        await asyncio.to_thread(score_buckets_collection.bulk_write, operations, ordered=False)
+    except Exception as e:
+        logger.error(f"Error updating score buckets: {e}")
+
+async def get_leaderboard(group_id: int = None, window: str = None):
+    """Fetch leaderboard from MongoDB, optionally for the current hour/day/week bucket"""
+    if window:
+        if leaderboard_buckets_collection is None:
+            logger.error("Score buckets collection not initialized")
+            return []
+
+        try:
+            return list(leaderboard_buckets_collection.find({
+                "window": window,
+                "bucket": score_bucket(window, datetime.utcnow()),
+                "group_id": group_id or GLOBAL_SCOPE
+            }).sort("score", -1).limit(10))
+        except Exception as e:
+            logger.error(f"Error getting {window} leaderboard: {e}")
+            return []
+
     # Corrected check: compare with None
-    if users_collection is None:
+    if leaderboard_users_collection is None:
         logger.error("Users collection not initialized")
         return []
 
     try:
         if group_id:
-            return list(users_collection.find().sort(f"group_scores.{group_id}", -1).limit(10))
-        return list(users_collection.find().sort("total_score", -1).limit(10))
+            return list(leaderboard_users_collection.find().sort(f"group_scores.{group_id}", -1).limit(10))
+        return list(leaderboard_users_collection.find().sort("total_score", -1).limit(10))
     except Exception as e:
         logger.error(f"Error getting leaderboard: {e}")
         return []
@@ -146,172 +678,364 @@ async def is_admin(chat_id: int, user_id: int, client: Client):
     """Check if user is admin in a chat"""
     try:
         chat_member = await client.get_chat_member(chat_id, user_id)
-        return chat_member.status in ["administrator", "creator"]
+        return chat_member.status in [enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER]
     except Exception as e:
         logger.error(f"Error checking admin status: {e}")
         return False
 
-async def save_game_state(chat_id: int):
-    """Save game state to MongoDB"""
-    # Corrected check: compare with None
-    if game_states_collection is None or chat_id not in active_games:
+# Forum supergroups have their own chat type, which filters.group does not match
+GROUP_CHAT_TYPES = [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP, enums.ChatType.FORUM]
+group_chats = filters.create(lambda _, __, message: bool(message.chat and message.chat.type in GROUP_CHAT_TYPES))
+GENERAL_TOPIC_ID = 1
+
+def get_thread_id(message: Message):
+    """Return the forum topic a message belongs to, or 0 outside forum topics"""
+    if not message.is_topic_message or message.message_thread_id == GENERAL_TOPIC_ID:
+        # General shares thread 0 with non-forum chats; sending there needs no thread id
+        return 0
+    return message.message_thread_id or 0
+
+def new_game_key(chat_id: int, thread_id: int):
+    """Build a key for a new game session in a chat topic"""
+    return (chat_id, thread_id, f"{random.getrandbits(32):08x}")
+
+def game_doc_id(game_key: tuple):
+    """Compound _id of a game session's game_states document"""
+    chat_id, thread_id, game_id = game_key
+    return {"chat_id": chat_id, "thread_id": thread_id, "game_id": game_id}
+
+def register_game(game_key: tuple, game_state: dict):
+    """Add a game session and index it by chat topic"""
+    active_games[game_key] = game_state
+    topic_games[game_key[:2]] = game_key
+
+def cancel_game_tasks(game_state: dict):
+    """Cancel a game's timers; return the cancelled tasks"""
+    tasks = [game_state[field] for field in RUNTIME_FIELDS if game_state.get(field)]
+    for task in tasks:
+        task.cancel()
+    return tasks
+
+async def remove_game(game_key: tuple):
+    """Drop a game session from memory, the topic index and the state store"""
+    active_games.pop(game_key, None)
+    recent_replies.pop(game_key, None)
+    close_lobby(game_key)
+    if game_key in pending_saves:
+        pending_saves.pop(game_key).cancel()
+    if topic_games.get(game_key[:2]) == game_key:
+        del topic_games[game_key[:2]]
+    if state_store is not None:
+        try:
+            await state_store.delete(game_key)
+        except Exception as e:
+            logger.error(f"Error deleting game state: {e}")
+
+async def send_game_message(game_key: tuple, client: Client, text: str, **kwargs):
+    """Send a message into the chat topic a game session is running in"""
+    chat_id, thread_id, _ = game_key
+    return await client.send_message(
+        chat_id=chat_id,
+        text=text,
+        message_thread_id=thread_id or None,
+        **kwargs
+    )
+
+def pack_players(players: list):
+    """Compact roster for storage: [[user_id, username], ...] instead of dicts"""
+    return [[p["user_id"], p["username"]] for p in players]
+
+def unpack_players(players: list):
+    """Inverse of pack_players; rosters saved before packing are dicts already"""
+    return [p if isinstance(p, dict) else {"user_id": p[0], "username": p[1]} for p in players]
+
+def game_state_snapshot(game_key: tuple):
+    """Copy a game's state without the fields that can't be persisted"""
+    game_state = active_games[game_key].copy()
+    game_state.pop("_id", None)
+    for field in RUNTIME_FIELDS:
+        game_state.pop(field, None)
+    game_state["players"] = pack_players(game_state.get("players", []))
+    return game_state
+
+def remaining_timer_delay(game_state: dict):
+    """Seconds left on a game's persisted timer, or None if it has none"""
+    deadline = game_state.get("timer_deadline")
+    if deadline is None:
+        return None
+    paused = game_state.get("timer_paused")
+    if paused and paused.get("deadline") == deadline:
+        # Paused by a drain: time spent restarting does not count against the players
+        return paused["remaining"]
+    return max(0.0, (deadline - datetime.utcnow()).total_seconds())
+
+async def save_game_state(game_key: tuple, background: bool = False):
+    """Save game state to the state store, optionally off the event loop thread"""
+    if state_store is None or game_key not in active_games:
         return
 
     try:
-        game_state = active_games[chat_id].copy()
-        if "timer_task" in game_state:
-            del game_state["timer_task"]
-
-        game_states_collection.update_one(
-            {"_id": chat_id},
-            {"$set": game_state},
-            upsert=True
-        )
-        logger.info(f"Saved game state for chat {chat_id}")
+        await state_store.save(game_key, game_state_snapshot(game_key), background=background)
+        logger.info(f"Saved game state for {game_key}")
     except Exception as e:
         logger.error(f"Error saving game state: {e}")
 
 async def load_game_states():
-    """Load active games from MongoDB"""
-    global active_games
-    # Corrected check: compare with None
-    if game_states_collection is None:
-        logger.error("Game states collection not initialized")
+    """Load active games from the state store"""
+    if state_store is None:
+        logger.error("Game state store not initialized")
         return
 
     try:
-        active_games = {doc["_id"]: doc for doc in game_states_collection.find()}
+        active_games.clear()
+        topic_games.clear()
+        for game_key, game_state in (await state_store.load_all()).items():
+            game_state["players"] = unpack_players(game_state.get("players", []))
+            register_game(game_key, game_state)
         logger.info(f"Loaded {len(active_games)} active games")
     except Exception as e:
         logger.error(f"Error loading game states: {e}")
 
-async def auto_end_game(chat_id: int, client: Client):
+async def auto_end_game(game_key: tuple, client: Client):
     """Automatically end inactive games"""
-    while chat_id in active_games and active_games[chat_id]["status"] == "in_progress":
-        game_state = active_games.get(chat_id)
+    while game_key in active_games and active_games[game_key]["status"] == "in_progress":
+        game_state = active_games.get(game_key)
         if not game_state:
             break
 
         last_activity = game_state.get("last_activity_time", datetime.utcnow())
         if (datetime.utcnow() - last_activity).total_seconds() >= 300:  # 5 minutes
-            await client.send_message(chat_id, "Game auto-ended due to inactivity")
-            del active_games[chat_id]
-            # Corrected check: compare with None
-            if game_states_collection is not None:
-                game_states_collection.delete_one({"_id": chat_id})
-            logger.info(f"Auto-ended game in chat {chat_id}")
+            await send_game_message(game_key, client, "Game auto-ended due to inactivity")
+            await remove_game(game_key)
+            logger.info(f"Auto-ended game {game_key}")
             break
 
         await asyncio.sleep(30)
 
+# Lobby functions
+def lobby_keyboard(game_key: tuple):
+    """Join button for a game's lobby message"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Join Game", callback_data=f"join_game_{game_key[1]}_{game_key[2]}")
+    ]])
+
+def render_lobby_text(game_state: dict):
+    """Render the lobby message, listing at most LOBBY_ROSTER_PREVIEW names"""
+    game_name = next((name for name, code in GAMES_LIST if code == game_state["game_type"]), "Game")
+    players = game_state["players"]
+    player_list = "\n".join(p["username"] for p in players[:LOBBY_ROSTER_PREVIEW])
+    if len(players) > LOBBY_ROSTER_PREVIEW:
+        player_list += f"\n...and {len(players) - LOBBY_ROSTER_PREVIEW} more"
+    return f"**{game_name} Starting!**\n\nPlayers ({len(players)}/{LOBBY_MAX_PLAYERS}):\n{player_list}"
+
+def get_lobby(game_key: tuple):
+    """Return the lobby for a waiting game, building its join index if needed"""
+    lobby = lobbies.get(game_key)
+    if lobby is None:
+        players = active_games[game_key]["players"]
+        lobby = lobbies[game_key] = {
+            "members": {p["user_id"] for p in players},
+            "task": None,
+            "last_edit": 0.0
+        }
+    return lobby
+
+def close_lobby(game_key: tuple):
+    """Forget a lobby and cancel any pending message edit"""
+    lobby = lobbies.pop(game_key, None)
+    if lobby and lobby["task"]:
+        lobby["task"].cancel()
+
+def schedule_lobby_update(game_key: tuple, client: Client):
+    """Make sure one lobby message edit is pending for this game"""
+    lobby = get_lobby(game_key)
+    if lobby["task"] is None:
+        lobby["task"] = asyncio.create_task(update_lobby_message(game_key, client))
+
+async def update_lobby_message(game_key: tuple, client: Client):
+    """Edit the lobby message at most once per LOBBY_EDIT_INTERVAL with the latest roster"""
+    lobby = lobbies[game_key]
+    delay = LOBBY_EDIT_INTERVAL - (time.monotonic() - lobby["last_edit"])
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+    # Joins from here on schedule a fresh edit
+    lobby["task"] = None
+    game_state = active_games.get(game_key)
+    if not game_state or game_state["status"] != "waiting_for_players":
+        return
+
+    lobby["last_edit"] = time.monotonic()
+    text = render_lobby_text(game_state)
+    try:
+        await client.edit_message_text(
+            chat_id=game_key[0],
+            message_id=game_state.get("lobby_message_id"),
+            text=text,
+            reply_markup=lobby_keyboard(game_key)
+        )
+    except MessageNotModified:
+        pass
+    except FloodWait as e:
+        lobby["last_edit"] = time.monotonic() + e.value
+        schedule_lobby_update(game_key, client)
+        return
+    except Exception as e:
+        logger.error(f"Error editing lobby message: {e}")
+        try:
+            sent = await send_game_message(game_key, client, text=text, reply_markup=lobby_keyboard(game_key))
+        except Exception as e:
+            logger.error(f"Error resending lobby message: {e}")
+            return
+        # The roster itself is checkpointed by the join's debounced save
+        game_state["lobby_message_id"] = sent.id
+        schedule_game_save(game_key)
+
 # Game management functions
-async def start_game_countdown(chat_id: int, game_type: str, message: Message, client: Client):
+async def edit_lobby_message(game_key: tuple, client: Client, text: str):
+    """Replace the lobby message text (this also removes the join button)"""
+    try:
+        await client.edit_message_text(
+            chat_id=game_key[0],
+            message_id=active_games[game_key].get("lobby_message_id"),
+            text=text
+        )
+    except Exception as e:
+        logger.error(f"Error editing lobby message: {e}")
+
+async def start_game_countdown(game_key: tuple, game_type: str, client: Client, delay: float = LOBBY_COUNTDOWN_SECONDS):
     """Countdown before game starts"""
-    await asyncio.sleep(60)
+    if game_key in active_games:
+        active_games[game_key]["timer_deadline"] = datetime.utcnow() + timedelta(seconds=delay)
+    await asyncio.sleep(delay)
 
-    if chat_id in active_games and active_games[chat_id]["status"] == "waiting_for_players":
-        game_state = active_games[chat_id]
+    if game_key in active_games and active_games[game_key]["status"] == "waiting_for_players":
+        game_state = active_games[game_key]
         game_state["status"] = "in_progress"
-        await save_game_state(chat_id)
+        close_lobby(game_key)
+        await save_game_state(game_key)
 
         players_count = len(game_state["players"])
         if players_count == 0:
-            await message.edit_text("Game cancelled - no players joined")
-            del active_games[chat_id]
-            # Corrected check: compare with None
-            if game_states_collection is not None:
-                game_states_collection.delete_one({"_id": chat_id})
+            await edit_lobby_message(game_key, client, "Game cancelled - no players joined")
+            await remove_game(game_key)
             return
 
         game_name = next((name for name, code in GAMES_LIST if code == game_type), "Game")
-        await message.edit_text(f"**{game_name} Started!**\n\nPlayers: {players_count}")
+        await edit_lobby_message(game_key, client, f"**{game_name} Started!**\n\nPlayers: {players_count}")
 
         # Start specific game
         if game_type == "quiz":
-            await start_quiz_game(chat_id, client)
+            await start_quiz_game(game_key, client)
         elif game_type == "wordchain":
-            await start_wordchain_game(chat_id, client)
+            await start_wordchain_game(game_key, client)
         elif game_type == "guessing":
-            await start_guessing_game(chat_id, client)
+            await start_guessing_game(game_key, client)
         elif game_type == "number_guessing":
-            await start_number_guessing_game(chat_id, client)
+            await start_number_guessing_game(game_key, client)
 
-    if chat_id in active_games:
-        active_games[chat_id]["timer_task"] = asyncio.create_task(
-            auto_end_game(chat_id, client)
+    # Kept apart from timer_task so turn timers can still be cancelled
+    if game_key in active_games and game_type != "number_guessing":
+        active_games[game_key]["inactivity_task"] = asyncio.create_task(
+            auto_end_game(game_key, client)
         )
 
 # Quiz game functions
-async def start_quiz_game(chat_id: int, client: Client):
+async def start_quiz_game(game_key: tuple, client: Client):
     """Initialize quiz game"""
     questions = await get_channel_content("quiz")
     if not questions:
-        await client.send_message(chat_id, "Could not load quiz questions")
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+        await send_game_message(game_key, client, "Could not load quiz questions")
+        await remove_game(game_key)
         return
 
-    active_games[chat_id].update({
-        "quiz_data": random.sample(questions, min(len(questions), 10)),
+    quiz_data = random.sample(questions, min(len(questions), QUIZ_ROUNDS))
+    active_games[game_key].update({
+        "quiz_data": quiz_data,
+        "quiz_rounds": render_quiz_rounds(quiz_data),
         "current_round": 0,
         "current_question": {},
         "answered_this_round": False,
         "last_activity_time": datetime.utcnow()
     })
-    await save_game_state(chat_id)
+    await save_game_state(game_key)
 
-    active_games[chat_id]["timer_task"] = asyncio.create_task(
-        send_next_quiz_question(chat_id, client)
+    active_games[game_key]["timer_task"] = asyncio.create_task(
+        send_next_quiz_question(game_key, client)
     )
 
-async def send_next_quiz_question(chat_id: int, client: Client):
-    """Send next quiz question with timer"""
-    while chat_id in active_games and active_games[chat_id]["status"] == "in_progress":
-        game_state = active_games[chat_id]
-        if game_state["current_round"] >= len(game_state["quiz_data"]):
-            await client.send_message(chat_id, "Quiz completed!")
-            del active_games[chat_id]
-            # Corrected check: compare with None
-            if game_states_collection is not None:
-                game_states_collection.delete_one({"_id": chat_id})
-            break
-
-        question_data = game_state["quiz_data"][game_state["current_round"]]
+def normalize_answer(text: str):
+    """Normalize an answer for comparison (case and whitespace insensitive)"""
+    return " ".join(text.lower().split())
 
-        # Removed poll-related message sending
-        await client.send_message(
-            chat_id=chat_id,
-            text=f"**Question {game_state['current_round'] + 1}:**\n\n{question_data['text']}",
-            parse_mode="Markdown"
-        )
-        game_state["current_question"] = {
-            "type": "text",
-            "correct_answer": question_data["answer"].lower()
+def render_quiz_rounds(quiz_data: list):
+    """Pre-render question texts and answer matchers for every round"""
+    return [
+        {
+            "text": f"**Question {i}:**\n\n{question_data['text']}",
+            "answer": normalize_answer(question_data["answer"]),
         }
+        for i, question_data in enumerate(quiz_data, 1)
+    ]
 
-        game_state.update({
-            "answered_this_round": False,
-            "last_activity_time": datetime.utcnow()
-        })
-        await save_game_state(chat_id)
+async def send_next_quiz_question(game_key: tuple, client: Client, resume_delay: float = None):
+    """Run quiz rounds, advancing early once a question is answered.
 
-        await asyncio.sleep(20)
+    resume_delay continues a round that was already sent before a restart.
+    """
+    round_event = quiz_round_events.setdefault(game_key, asyncio.Event())
+    try:
+        while game_key in active_games and active_games[game_key]["status"] == "in_progress":
+            game_state = active_games[game_key]
+            if "quiz_rounds" not in game_state:
+                game_state["quiz_rounds"] = render_quiz_rounds(game_state["quiz_data"])
+
+            if game_state["current_round"] >= len(game_state["quiz_rounds"]):
+                await send_game_message(game_key, client, "Quiz completed!")
+                await remove_game(game_key)
+                break
+
+            quiz_round = game_state["quiz_rounds"][game_state["current_round"]]
+            if resume_delay is None:
+                game_state.update({
+                    "current_question": {"type": "text", "correct_answer": quiz_round["answer"]},
+                    "answered_this_round": False,
+                    "timer_deadline": datetime.utcnow() + timedelta(seconds=QUIZ_ROUND_SECONDS),
+                    "last_activity_time": datetime.utcnow()
+                })
+                round_event.clear()
+
+                # Checkpoint runs in a worker thread while the question is being sent
+                await asyncio.gather(
+                    send_game_message(game_key, client, text=quiz_round["text"], parse_mode="Markdown"),
+                    save_game_state(game_key, background=True)
+                )
+                round_seconds = QUIZ_ROUND_SECONDS
+            else:
+                round_seconds = 0 if game_state["answered_this_round"] else resume_delay
+                game_state["timer_deadline"] = datetime.utcnow() + timedelta(seconds=round_seconds)
+                resume_delay = None
 
-        if not game_state["answered_this_round"]:
-            await client.send_message(
-                chat_id=chat_id,
-                text=f"Time's up! Correct answer: **{game_state['current_question']['correct_answer'].upper()}**"
-            )
+            try:
+                await asyncio.wait_for(round_event.wait(), timeout=round_seconds)
+                await asyncio.sleep(QUIZ_ADVANCE_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+            if not game_state["answered_this_round"]:
+                await send_game_message(
+                    game_key, client,
+                    text=f"Time's up! Correct answer: **{quiz_round['answer'].upper()}**"
+                )
 
-        game_state["current_round"] += 1
+            game_state["current_round"] += 1
+    finally:
+        quiz_round_events.pop(game_key, None)
 
-async def handle_quiz_answer_text(message: Message, client: Client):
+async def handle_quiz_answer_text(message: Message, client: Client, game_key: tuple):
     """Handle text answers for quiz"""
-    chat_id = message.chat.id
     user = message.from_user
-    game_state = active_games.get(chat_id)
+    game_state = active_games.get(game_key)
 
     if not game_state or game_state["game_type"] != "quiz" or game_state["status"] != "in_progress":
         return
@@ -320,68 +1044,63 @@ async def handle_quiz_answer_text(message: Message, client: Client):
         return
 
     if game_state["answered_this_round"]:
-        await message.reply("This question was already answered")
+        await coalesced_reply(message, game_key, "This question was already answered")
         return
 
-    user_answer = message.text.lower()
+    user_answer = normalize_answer(message.text)
     correct_answer = game_state["current_question"]["correct_answer"]
 
     if user_answer == correct_answer:
-        await message.reply(f"Correct! +10 points")
-        await update_user_score(user.id, user.full_name, chat_id, 10)
         game_state.update({
             "answered_this_round": True,
             "last_activity_time": datetime.utcnow()
         })
-        await save_game_state(chat_id)
+        if game_key in quiz_round_events:
+            quiz_round_events[game_key].set()
+        await message.reply(f"Correct! +10 points")
+        await update_user_score(user.id, user.full_name, game_key[0], 10, game_state["game_type"])
+        await save_game_state(game_key)
 
 # Wordchain game functions
-async def start_wordchain_game(chat_id: int, client: Client):
+async def start_wordchain_game(game_key: tuple, client: Client):
     """Initialize wordchain game"""
     words = await get_channel_content("wordchain")
     if not words:
-        await client.send_message(chat_id, "Could not load wordchain words")
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+        await send_game_message(game_key, client, "Could not load wordchain words")
+        await remove_game(game_key)
         return
 
     start_word = random.choice(words)["question"].strip().lower()
-    players = active_games[chat_id]["players"]
+    players = active_games[game_key]["players"]
 
     if not players:
-        await client.send_message(chat_id, "Game cancelled - no players")
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+        await send_game_message(game_key, client, "Game cancelled - no players")
+        await remove_game(game_key)
         return
 
-    active_games[chat_id].update({
+    active_games[game_key].update({
         "current_word": start_word,
         "turn_index": 0,
         "last_activity_time": datetime.utcnow()
     })
-    await save_game_state(chat_id)
+    await save_game_state(game_key)
 
     random.shuffle(players)
-    current_player = players[active_games[chat_id]["turn_index"]]
+    current_player = players[active_games[game_key]["turn_index"]]
 
-    await client.send_message(
-        chat_id=chat_id,
+    await send_game_message(
+        game_key, client,
         text=f"**Wordchain Started!**\n\nFirst word: **{start_word.upper()}**\n\n{current_player['username']}'s turn"
     )
 
-    active_games[chat_id]["timer_task"] = asyncio.create_task(
-        turn_timer(chat_id, 60, client, "wordchain")
+    active_games[game_key]["timer_task"] = asyncio.create_task(
+        turn_timer(game_key, 60, client, "wordchain")
     )
 
-async def handle_wordchain_answer(message: Message, client: Client):
+async def handle_wordchain_answer(message: Message, client: Client, game_key: tuple):
     """Handle wordchain answers"""
-    chat_id = message.chat.id
     user = message.from_user
-    game_state = active_games.get(chat_id)
+    game_state = active_games.get(game_key)
 
     if not game_state or game_state["game_type"] != "wordchain" or game_state["status"] != "in_progress":
         return
@@ -391,14 +1110,14 @@ async def handle_wordchain_answer(message: Message, client: Client):
 
     current_player = game_state["players"][game_state["turn_index"]]
     if user.id != current_player["user_id"]:
-        await message.reply("Not your turn!")
+        await coalesced_reply(message, game_key, "Not your turn!")
         return
 
     user_word = message.text.strip().lower()
     last_char = game_state["current_word"][-1].lower()
 
     if user_word.startswith(last_char) and len(user_word) > 1 and user_word.isalpha():
-        await update_user_score(user.id, user.full_name, chat_id, 5)
+        await update_user_score(user.id, user.full_name, game_key[0], 5, game_state["game_type"])
         await message.reply(f"Correct! New word: **{user_word.upper()}**")
 
         game_state.update({
@@ -406,61 +1125,55 @@ async def handle_wordchain_answer(message: Message, client: Client):
             "turn_index": (game_state["turn_index"] + 1) % len(game_state["players"]),
             "last_activity_time": datetime.utcnow()
         })
-        await save_game_state(chat_id)
+        await save_game_state(game_key)
 
         if game_state.get("timer_task"):
             game_state["timer_task"].cancel()
 
         next_player = game_state["players"][game_state["turn_index"]]
-        await client.send_message(
-            chat_id=chat_id,
+        await send_game_message(
+            game_key, client,
             text=f"{next_player['username']}'s turn. Word starting with '{user_word[-1].upper()}'"
         )
         game_state["timer_task"] = asyncio.create_task(
-            turn_timer(chat_id, 60, client, "wordchain")
+            turn_timer(game_key, 60, client, "wordchain")
         )
     else:
         await message.reply(f"Invalid word! {user.full_name} is out")
 
         game_state["players"] = [p for p in game_state["players"] if p["user_id"] != user.id]
         game_state["last_activity_time"] = datetime.utcnow()
-        await save_game_state(chat_id)
+        await save_game_state(game_key)
 
         if game_state.get("timer_task"):
             game_state["timer_task"].cancel()
 
         if len(game_state["players"]) < 2:
-            await client.send_message(chat_id, "Game ended - not enough players")
-            del active_games[chat_id]
-            # Corrected check: compare with None
-            if game_states_collection is not None:
-                game_states_collection.delete_one({"_id": chat_id})
+            await send_game_message(game_key, client, "Game ended - not enough players")
+            await remove_game(game_key)
         else:
             if game_state["turn_index"] >= len(game_state["players"]):
                 game_state["turn_index"] = 0
 
             next_player = game_state["players"][game_state["turn_index"]]
-            await client.send_message(
-                chat_id=chat_id,
+            await send_game_message(
+                game_key, client,
                 text=f"{next_player['username']}'s turn. Word starting with '{game_state['current_word'][-1].upper()}'"
             )
             game_state["timer_task"] = asyncio.create_task(
-                turn_timer(chat_id, 60, client, "wordchain")
+                turn_timer(game_key, 60, client, "wordchain")
             )
 
 # Guessing game functions
-async def start_guessing_game(chat_id: int, client: Client):
+async def start_guessing_game(game_key: tuple, client: Client):
     """Initialize guessing game"""
     guesses = await get_channel_content("guessing")
     if not guesses:
-        await client.send_message(chat_id, "Could not load guessing content")
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+        await send_game_message(game_key, client, "Could not load guessing content")
+        await remove_game(game_key)
         return
 
-    active_games[chat_id].update({
+    active_games[game_key].update({
         "guessing_data": random.sample(guesses, min(len(guesses), 5)),
         "current_round": 0,
         "current_guess_item": {},
@@ -468,30 +1181,27 @@ async def start_guessing_game(chat_id: int, client: Client):
         "guessed_this_round": False,
         "last_activity_time": datetime.utcnow()
     })
-    await save_game_state(chat_id)
+    await save_game_state(game_key)
 
-    active_games[chat_id]["timer_task"] = asyncio.create_task(
-        send_next_guess_item(chat_id, client)
+    active_games[game_key]["timer_task"] = asyncio.create_task(
+        send_next_guess_item(game_key, client)
     )
 
-async def send_next_guess_item(chat_id: int, client: Client):
+async def send_next_guess_item(game_key: tuple, client: Client):
     """Send next guessing game item"""
-    game_state = active_games.get(chat_id)
+    game_state = active_games.get(game_key)
     if not game_state or game_state["status"] != "in_progress" or game_state["game_type"] != "guessing":
         return
 
     if game_state["current_round"] >= len(game_state["guessing_data"]):
-        await client.send_message(chat_id, "Guessing game completed!")
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+        await send_game_message(game_key, client, "Guessing game completed!")
+        await remove_game(game_key)
         return
 
     guess_item = game_state["guessing_data"][game_state["current_round"]]
 
-    await client.send_message(
-        chat_id=chat_id,
+    await send_game_message(
+        game_key, client,
         text=f"**Round {game_state['current_round'] + 1}:**\n\nGuess: `{guess_item['question']}`",
         parse_mode="Markdown"
     )
@@ -505,19 +1215,18 @@ async def send_next_guess_item(chat_id: int, client: Client):
         "attempts": {str(p["user_id"]): 0 for p in game_state["players"]},
         "last_activity_time": datetime.utcnow()
     })
-    await save_game_state(chat_id)
+    await save_game_state(game_key)
 
     if game_state.get("timer_task"):
         game_state["timer_task"].cancel()
     game_state["timer_task"] = asyncio.create_task(
-        turn_timer(chat_id, 60, client, "guessing")
+        turn_timer(game_key, 60, client, "guessing")
     )
 
-async def handle_guessing_answer(message: Message, client: Client):
+async def handle_guessing_answer(message: Message, client: Client, game_key: tuple):
     """Handle guessing game answers"""
-    chat_id = message.chat.id
     user = message.from_user
-    game_state = active_games.get(chat_id)
+    game_state = active_games.get(game_key)
 
     if not game_state or game_state["game_type"] != "guessing" or game_state["status"] != "in_progress":
         return
@@ -532,50 +1241,50 @@ async def handle_guessing_answer(message: Message, client: Client):
     correct_answer = game_state["current_guess_item"]["answer"]
 
     if user_guess == correct_answer:
-        await update_user_score(user.id, user.full_name, chat_id, 15)
+        await update_user_score(user.id, user.full_name, game_key[0], 15, game_state["game_type"])
         await message.reply(f"Correct! +15 points")
         game_state["guessed_this_round"] = True
+        game_state["timer_deadline"] = None
 
         if game_state.get("timer_task"):
             game_state["timer_task"].cancel()
 
         game_state["current_round"] += 1
         game_state["last_activity_time"] = datetime.utcnow()
-        await save_game_state(chat_id)
-        active_games[chat_id]["timer_task"] = asyncio.create_task(
-            send_next_guess_item(chat_id, client)
+        await save_game_state(game_key)
+        active_games[game_key]["timer_task"] = asyncio.create_task(
+            send_next_guess_item(game_key, client)
         )
     else:
         user_id_str = str(user.id)
         game_state["attempts"][user_id_str] = game_state["attempts"].get(user_id_str, 0) + 1
-        await message.reply("Wrong guess, try again!")
+        await coalesced_reply(message, game_key, "Wrong guess, try again!")
         game_state["last_activity_time"] = datetime.utcnow()
-        await save_game_state(chat_id)
+        schedule_game_save(game_key)
 
 # Number guessing game functions
-async def start_number_guessing_game(chat_id: int, client: Client):
+async def start_number_guessing_game(game_key: tuple, client: Client):
     """Initialize number guessing game"""
     secret_number = random.randint(1, 100)
-    active_games[chat_id].update({
+    active_games[game_key].update({
         "secret_number": secret_number,
         "guesses_made": {},
         "last_activity_time": datetime.utcnow()
     })
-    await save_game_state(chat_id)
+    await save_game_state(game_key)
 
-    await client.send_message(
-        chat_id=chat_id,
+    await send_game_message(
+        game_key, client,
         text="**Number Guessing Started!**\n\nGuess a number between 1-100"
     )
-    active_games[chat_id]["timer_task"] = asyncio.create_task(
-        auto_end_game(chat_id, client)
+    active_games[game_key]["timer_task"] = asyncio.create_task(
+        auto_end_game(game_key, client)
     )
 
-async def handle_number_guess(message: Message, client: Client):
+async def handle_number_guess(message: Message, client: Client, game_key: tuple):
     """Handle number guessing game answers"""
-    chat_id = message.chat.id
     user = message.from_user
-    game_state = active_games.get(chat_id)
+    game_state = active_games.get(game_key)
 
     if not game_state or game_state["game_type"] != "number_guessing" or game_state["status"] != "in_progress":
         return
@@ -586,41 +1295,42 @@ async def handle_number_guess(message: Message, client: Client):
     try:
         user_guess = int(message.text)
         if not 1 <= user_guess <= 100:
-            await message.reply("Please guess between 1-100")
+            await coalesced_reply(message, game_key, "Please guess between 1-100")
             return
     except ValueError:
-        await message.reply("Please enter a valid number")
+        await coalesced_reply(message, game_key, "Please enter a valid number")
         return
 
     secret_number = game_state["secret_number"]
     user_id_str = str(user.id)
     game_state["guesses_made"][user_id_str] = game_state["guesses_made"].get(user_id_str, 0) + 1
     game_state["last_activity_time"] = datetime.utcnow()
-    await save_game_state(chat_id)
 
     if user_guess == secret_number:
         guesses_count = game_state["guesses_made"][user_id_str]
         points = max(10, 100 - (guesses_count * 5))
-        await update_user_score(user.id, user.full_name, chat_id, points)
+        await update_user_score(user.id, user.full_name, game_key[0], points, game_state["game_type"])
         await message.reply(f"Correct! +{points} points (guesses: {guesses_count})")
 
         if game_state.get("timer_task"):
             game_state["timer_task"].cancel()
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+        await remove_game(game_key)
     elif user_guess < secret_number:
-        await message.reply("Higher!")
+        schedule_game_save(game_key)
+        await coalesced_reply(message, game_key, "Higher!")
     else:
-        await message.reply("Lower!")
+        schedule_game_save(game_key)
+        await coalesced_reply(message, game_key, "Lower!")
 
 # Timer function
-async def turn_timer(chat_id: int, duration: int, client: Client, game_type: str):
-    """Handle turn timers for games"""
-    await asyncio.sleep(duration)
-
-    game_state = active_games.get(chat_id)
+async def turn_timer(game_key: tuple, duration: int, client: Client, game_type: str, delay: float = None):
+    """Handle turn timers for games (delay overrides duration for a resumed turn)"""
+    wait = duration if delay is None else delay
+    if game_key in active_games:
+        active_games[game_key]["timer_deadline"] = datetime.utcnow() + timedelta(seconds=wait)
+    await asyncio.sleep(wait)
+
+    game_state = active_games.get(game_key)
     if not game_state or game_state["status"] != "in_progress":
         return
 
@@ -629,51 +1339,589 @@ async def turn_timer(chat_id: int, duration: int, client: Client, game_type: str
             return
 
         current_player = game_state["players"][game_state["turn_index"]]
-        await client.send_message(
-            chat_id=chat_id,
+        await send_game_message(
+            game_key, client,
             text=f"{current_player['username']} didn't answer in time!"
         )
 
         game_state["players"].pop(game_state["turn_index"])
         game_state["last_activity_time"] = datetime.utcnow()
-        await save_game_state(chat_id)
+        await save_game_state(game_key)
 
         if len(game_state["players"]) < 2:
-            await client.send_message(chat_id, "Game ended - not enough players")
-            del active_games[chat_id]
-            # Corrected check: compare with None
-            if game_states_collection is not None:
-                game_states_collection.delete_one({"_id": chat_id})
+            await send_game_message(game_key, client, "Game ended - not enough players")
+            await remove_game(game_key)
         else:
             if game_state["turn_index"] >= len(game_state["players"]):
                 game_state["turn_index"] = 0
 
             next_player = game_state["players"][game_state["turn_index"]]
-            await client.send_message(
-                chat_id=chat_id,
+            await send_game_message(
+                game_key, client,
                 text=f"{next_player['username']}'s turn"
             )
             game_state["timer_task"] = asyncio.create_task(
-                turn_timer(chat_id, duration, client, "wordchain")
+                turn_timer(game_key, duration, client, "wordchain")
             )
 
     elif game_type == "guessing":
         if not game_state["guessed_this_round"]:
             correct_answer = game_state["current_guess_item"]["answer"]
-            await client.send_message(
-                chat_id=chat_id,
+            await send_game_message(
+                game_key, client,
                 text=f"Time's up! Answer: **{correct_answer.upper()}**"
             )
 
         game_state["current_round"] += 1
         game_state["last_activity_time"] = datetime.utcnow()
-        await save_game_state(chat_id)
-        active_games[chat_id]["timer_task"] = asyncio.create_task(
-            send_next_guess_item(chat_id, client)
+        await save_game_state(game_key)
+        active_games[game_key]["timer_task"] = asyncio.create_task(
+            send_next_guess_item(game_key, client)
         )
 
+# Answer throttling
+def allow_answer(chat_id: int, user_id: int):
+    """Take a token from the player's bucket; False means the message should be dropped"""
+    now = time.monotonic()
+    bucket = answer_buckets.get((chat_id, user_id))
+    if bucket is None:
+        bucket = answer_buckets[(chat_id, user_id)] = [ANSWER_BURST, now]
+    else:
+        bucket[0] = min(ANSWER_BURST, bucket[0] + (now - bucket[1]) * ANSWER_RATE)
+        bucket[1] = now
+
+    if bucket[0] < 1:
+        throttle_stats["dropped"] += 1
+        return False
+    bucket[0] -= 1
+    throttle_stats["allowed"] += 1
+    return True
+
+def _prune_throttle_state(now: float):
+    """Forget buckets that have refilled and replies outside the coalescing window"""
+    refill_seconds = ANSWER_BURST / ANSWER_RATE if ANSWER_RATE else 0
+    for key, (_, last_refill) in list(answer_buckets.items()):
+        if now - last_refill >= refill_seconds:
+            del answer_buckets[key]
+    for game_key, replies in list(recent_replies.items()):
+        for key, sent_at in list(replies.items()):
+            if now - sent_at >= REPLY_COALESCE_WINDOW:
+                del replies[key]
+        if not replies:
+            del recent_replies[game_key]
+
+async def throttle_pruner():
+    """Periodically prune throttle state, keeping the scan off the answer path"""
+    while True:
+        await asyncio.sleep(THROTTLE_PRUNE_INTERVAL)
+        _prune_throttle_state(time.monotonic())
+
+async def coalesced_reply(message: Message, game_key: tuple, text: str):
+    """Reply unless the same player got this exact reply within REPLY_COALESCE_WINDOW"""
+    now = time.monotonic()
+    replies = recent_replies.setdefault(game_key, {})
+    key = (message.from_user.id, text)
+    if now - replies.get(key, float("-inf")) < REPLY_COALESCE_WINDOW:
+        throttle_stats["coalesced_replies"] += 1
+        return
+    replies[key] = now
+    await message.reply(text)
+
+def schedule_game_save(game_key: tuple):
+    """Save a game at most once per GAME_SAVE_DEBOUNCE seconds for low-value updates"""
+    if game_key in pending_saves:
+        throttle_stats["deferred_saves"] += 1
+        return
+    pending_saves[game_key] = asyncio.create_task(_debounced_save(game_key))
+
+async def _debounced_save(game_key: tuple):
+    """Wait out the debounce interval, then save the game's latest state"""
+    await asyncio.sleep(GAME_SAVE_DEBOUNCE)
+    pending_saves.pop(game_key, None)
+    await save_game_state(game_key)
+
+# Group registry
+def touch_group(chat_id: int, name: str = None, active: bool = True):
+    """Record group activity, marking it dirty only if a write is actually needed"""
+    now = datetime.utcnow()
+    group_registry_stats["touches"] += 1
+    entry = group_registry.get(chat_id)
+    if entry is None:
+        group_registry[chat_id] = {"name": name, "active": active, "last_seen": now, "written_last_seen": None}
+        dirty_groups.add(chat_id)
+        return
+
+    entry["last_seen"] = now
+    if name is not None and entry["name"] != name:
+        entry["name"] = name
+        dirty_groups.add(chat_id)
+    if entry["active"] != active:
+        entry["active"] = active
+        dirty_groups.add(chat_id)
+    if entry["written_last_seen"] is None or (now - entry["written_last_seen"]).total_seconds() >= GROUP_LAST_SEEN_INTERVAL:
+        dirty_groups.add(chat_id)
+
+async def flush_group_registry():
+    """Write all dirty groups to MongoDB in a single bulk operation"""
+    if groups_collection is None or not dirty_groups:
+        return
+
+    chat_ids = list(dirty_groups)
+    dirty_groups.clear()
+    operations = []
+    written_last_seen = {}
+    for chat_id in chat_ids:
+        entry = group_registry[chat_id]
+        fields = {"active": entry["active"], "last_seen": entry["last_seen"]}
+        if entry["name"] is not None:
+            fields["name"] = entry["name"]
+        operations.append(UpdateOne({"_id": chat_id}, {"$set": fields}, upsert=True))
+        written_last_seen[chat_id] = entry["last_seen"]
+
+    try:
+        await asyncio.to_thread(groups_collection.bulk_write, operations, ordered=False)
+        for chat_id, last_seen in written_last_seen.items():
+            group_registry[chat_id]["written_last_seen"] = last_seen
+        group_registry_stats["writes"] += len(operations)
+        group_registry_stats["flushes"] += 1
+    except Exception as e:
+        dirty_groups.update(chat_ids)
+        logger.error(f"Error flushing group registry: {e}")
+
+async def group_registry_flusher():
+    """Periodically flush dirty groups"""
+    while True:
+        await asyncio.sleep(GROUP_FLUSH_INTERVAL)
+        await flush_group_registry()
+
+# Score event log
+def record_score_event(user_id: int, group_id: int, game_type: str, points: int, when: datetime):
+    """Buffer a score event for the next batch insert into score_events"""
+    score_event_buffer.append({
+        "user_id": user_id,
+        "group_id": group_id,
+        "game_type": game_type or "unknown",
+        "points": points,
+        "ts": when
+    })
+    score_event_stats["buffered"] += 1
+    # One batch flush at a time; the buffer keeps growing while it runs
+    if len(score_event_buffer) >= SCORE_EVENT_BATCH_SIZE and not score_flush_tasks:
+        task = asyncio.create_task(flush_score_events())
+        score_flush_tasks.add(task)
+        task.add_done_callback(score_flush_tasks.discard)
+
+async def flush_score_events():
+    """Insert all buffered score events in one batch, off the event loop"""
+    if score_events_collection is None or not score_event_buffer:
+        return
+
+    # Swap the batch out first so events recorded during the insert start the next one
+    events = score_event_buffer[:]
+    score_event_buffer.clear()
+    try:
+        await asyncio.to_thread(score_events_collection.insert_many, events, ordered=False)
+        score_event_stats["written"] += len(events)
+    except Exception as e:
+        score_event_stats["failed"] += len(events)
+        logger.error(f"Error writing score events: {e}")
+
+async def score_event_flusher():
+    """Periodically flush buffered score events"""
+    while True:
+        await asyncio.sleep(SCORE_EVENT_FLUSH_INTERVAL)
+        await flush_score_events()
+
+# Consumers tail score_events through a change stream and keep derived
+# aggregates up to date. Resume tokens are checkpointed in stream_offsets, so
+# delivery is at-least-once: events after the last checkpoint are replayed.
+# Aggregates remember the ids of their last SCORE_CONSUMER_CHECKPOINT_EVERY
+# events, which covers any replay, and skip events they have already applied.
+score_event_consumers = {}
+
+def score_event_consumer(name: str):
+    """Register a function that is called with every new score event"""
+    def decorator(func):
+        score_event_consumers[name] = func
+        return func
+    return decorator
+
+def _checkpoint_consumer(name: str, resume_token):
+    """Store a consumer's resume token"""
+    stream_offsets_collection.update_one(
+        {"_id": name},
+        {"$set": {"resume_token": resume_token, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+def consume_score_events(name: str, handler, stop_event: Event):
+    """Tail score_events for one consumer until stop_event is set (runs in a thread)"""
+    while not stop_event.is_set():
+        try:
+            offset = stream_offsets_collection.find_one({"_id": name})
+            resume_token = offset.get("resume_token") if offset else None
+            pending = 0
+            with score_events_collection.watch(
+                [{"$match": {"operationType": "insert"}}],
+                resume_after=resume_token,
+                max_await_time_ms=1000
+            ) as stream:
+                while stream.alive and not stop_event.is_set():
+                    change = stream.try_next()
+                    if change is not None:
+                        handler(change["fullDocument"])
+                        score_event_stats["consumed"] += 1
+                        pending += 1
+                    if pending and (change is None or pending >= SCORE_CONSUMER_CHECKPOINT_EVERY):
+                        _checkpoint_consumer(name, stream.resume_token)
+                        pending = 0
+                if pending:
+                    _checkpoint_consumer(name, stream.resume_token)
+        except Exception as e:
+            logger.error(f"Score event consumer {name} failed: {e}")
+            stop_event.wait(30)
+
+def start_score_event_consumers(stop_event: Event):
+    """Start one daemon thread per registered consumer and return the threads"""
+    consumer_threads = []
+    for name, handler in score_event_consumers.items():
+        consumer_thread = Thread(target=consume_score_events, args=(name, handler, stop_event), name=f"consumer-{name}")
+        consumer_thread.daemon = True
+        consumer_thread.start()
+        consumer_threads.append(consumer_thread)
+        logger.info(f"Score event consumer {name} started")
+    return consumer_threads
+
+def stop_score_event_consumers(stop_event: Event, consumer_threads: list):
+    """Stop the consumers and wait for their final checkpoints"""
+    stop_event.set()
+    deadline = time.monotonic() + SCORE_CONSUMER_JOIN_TIMEOUT
+    for consumer_thread in consumer_threads:
+        consumer_thread.join(max(0.0, deadline - time.monotonic()))
+        if consumer_thread.is_alive():
+            logger.warning(f"{consumer_thread.name} did not stop within {SCORE_CONSUMER_JOIN_TIMEOUT}s")
+
+def apply_aggregate(collection, aggregate_id, event: dict, update: dict):
+    """Apply an aggregate update once per event, ignoring replays"""
+    update = dict(update, **{"$push": {
+        "applied_events": {"$each": [event["_id"]], "$slice": -SCORE_CONSUMER_CHECKPOINT_EVERY}
+    }})
+    try:
+        collection.update_one(
+            {"_id": aggregate_id, "applied_events": {"$ne": event["_id"]}},
+            update,
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The aggregate exists and already lists this event, so the upsert's insert collided
+        score_event_stats["replayed"] += 1
+
+@score_event_consumer("game_type_stats")
+def aggregate_game_type_stats(event: dict):
+    """Maintain per-game-type event and point totals"""
+    apply_aggregate(game_type_stats_collection, event["game_type"], event, {
+        "$inc": {"events": 1, "points": event["points"]},
+        "$max": {"last_event_at": event["ts"]}
+    })
+
+@score_event_consumer("group_activity")
+def aggregate_group_activity(event: dict):
+    """Maintain per-group activity totals"""
+    apply_aggregate(group_activity_collection, event["group_id"], event, {
+        "$inc": {"events": 1, "points": event["points"], f"game_types.{event['game_type']}": 1},
+        "$max": {"last_event_at": event["ts"]}
+    })
+
+# Log forwarder
+def queue_log_event(kind: str, name: str):
+    """Queue an event for the next log channel digest without waiting on Telegram"""
+    if not LOG_CHANNEL_ID:
+        return
+    if len(log_events) == log_events.maxlen:
+        log_forwarder_stats["dropped"] += 1
+    log_events.append((kind, name))
+    log_forwarder_stats["queued"] += 1
+
+def format_log_digest(events: list):
+    """Build a digest message with counts and a sample of names per event kind"""
+    grouped = defaultdict(list)
+    for kind, name in events:
+        grouped[kind].append(name)
+
+    digest = f"**Activity digest ({len(events)} events)**\n"
+    for kind, names in grouped.items():
+        digest += f"\n**{LOG_EVENT_LABELS.get(kind, kind)}: {len(names)}**\n"
+        for name in names[:LOG_DIGEST_SAMPLE]:
+            digest += f"- {name}\n"
+        if len(names) > LOG_DIGEST_SAMPLE:
+            digest += f"...and {len(names) - LOG_DIGEST_SAMPLE} more\n"
+    if log_forwarder_stats["dropped"]:
+        digest += f"\nDropped under load so far: {log_forwarder_stats['dropped']}"
+    return digest
+
+async def flush_log_events(client: Client):
+    """Send everything queued so far as a single digest message"""
+    if not log_events:
+        return
+
+    events = list(log_events)
+    log_events.clear()
+    try:
+        await client.send_message(LOG_CHANNEL_ID, format_log_digest(events))
+        log_forwarder_stats["sent"] += len(events)
+        log_forwarder_stats["digests"] += 1
+    except Exception as e:
+        log_forwarder_stats["failed"] += len(events)
+        logger.error(f"Failed to send log digest: {e}")
+
+async def log_forwarder(client: Client):
+    """Periodically flush queued log events to the log channel"""
+    while True:
+        await asyncio.sleep(LOG_DIGEST_INTERVAL)
+        await flush_log_events(client)
+
+# Profiling
+# Nothing below runs unless /profile is active: timing spans are installed by
+# swapping in wrappers for the window and restoring the originals afterwards.
+PROFILED_HELPERS = [
+    "get_channel_content",
+    "update_user_score",
+    "get_leaderboard",
+    "save_game_state",
+    "load_game_states",
+]
+PROFILED_CLIENT_METHODS = ["send_message", "edit_message_text"]
+
+profile_session = None
+
+def _timed(name: str, func, spans: dict):
+    """Wrap a coroutine function so each call records its duration in spans"""
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            spans[name].append(time.perf_counter() - start)
+    wrapper.__name__ = getattr(func, "__name__", name)
+    return wrapper
+
+def _install_spans(spans: dict, client: Client, originals: dict):
+    """Wrap handlers, Mongo helpers and client sends, recording what to restore
+    in originals as it goes so a failed install can still be undone"""
+    for name in PROFILED_HELPERS:
+        originals["helpers"][name] = globals()[name]
+        globals()[name] = _timed(name, globals()[name], spans)
+
+    for handlers in client.dispatcher.groups.values():
+        for handler in handlers:
+            originals["handlers"].append((handler, handler.callback))
+            handler.callback = _timed(f"handler.{handler.callback.__name__}", handler.callback, spans)
+
+    for name in PROFILED_CLIENT_METHODS:
+        setattr(client, name, _timed(f"client.{name}", getattr(client, name), spans))
+        originals["client_methods"].append(name)
+
+def _remove_spans(originals: dict, client: Client):
+    """Restore everything replaced by _install_spans"""
+    for name, func in originals["helpers"].items():
+        globals()[name] = func
+    for handler, callback in originals["handlers"]:
+        handler.callback = callback
+    for name in originals["client_methods"]:
+        delattr(client, name)
+
+def _sample_stacks(thread_id: int, stacks: Counter, stop_event: Event):
+    """Sample the event loop thread's stack until stop_event is set"""
+    while not stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if names:
+            stacks[";".join(reversed(names))] += 1
+
+def write_folded_profile(stacks: Counter):
+    """Write samples in the collapsed-stack format used by flamegraph.pl/speedscope"""
+    os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_OUTPUT_DIR, f"profile-{datetime.utcnow():%Y%m%d-%H%M%S}.folded")
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+def format_profile_summary(seconds: int, stacks: Counter, spans: dict):
+    """Build a top-N summary of leaf frames and timing spans"""
+    total_samples = sum(stacks.values())
+    leaf_counts = Counter()
+    for stack, count in stacks.items():
+        leaf_counts[stack.rsplit(";", 1)[-1]] += count
+
+    summary = f"**Profile ({seconds}s, {total_samples} samples)**\n\n**Top frames:**\n"
+    for frame, count in leaf_counts.most_common(PROFILE_TOP_N):
+        summary += f"{count * 100 / total_samples:.1f}% {frame}\n"
+    if not leaf_counts:
+        summary += "No samples\n"
+
+    summary += "\n**Spans (calls / avg ms / max ms):**\n"
+    by_total = sorted(spans.items(), key=lambda item: sum(item[1]), reverse=True)
+    for name, durations in by_total[:PROFILE_TOP_N]:
+        avg_ms = sum(durations) * 1000 / len(durations)
+        summary += f"{name}: {len(durations)} / {avg_ms:.1f} / {max(durations) * 1000:.1f}\n"
+    if not by_total:
+        summary += "No calls recorded\n"
+    return summary
+
+async def run_profile(seconds: int, client: Client, reply_chat_id: int):
+    """Profile the bot for a bounded window and report the results"""
+    global profile_session
+    stacks = Counter()
+    spans = defaultdict(list)
+    stop_event = Event()
+    originals = {"helpers": {}, "handlers": [], "client_methods": []}
+    sampler = None
+
+    try:
+        _install_spans(spans, client, originals)
+        sampler = Thread(target=_sample_stacks, args=(get_ident(), stacks, stop_event))
+        sampler.daemon = True
+        sampler.start()
+        await asyncio.sleep(seconds)
+    except Exception as e:
+        logger.error(f"Profiling failed: {e}")
+        return
+    finally:
+        stop_event.set()
+        if sampler:
+            sampler.join()
+        _remove_spans(originals, client)
+        profile_session = None
+
+    try:
+        path = write_folded_profile(stacks)
+        logger.info(f"Profile written to {path}")
+    except Exception as e:
+        logger.error(f"Error writing profile: {e}")
+        path = None
+
+    target_chat = LOG_CHANNEL_ID or reply_chat_id
+    try:
+        await client.send_message(target_chat, format_profile_summary(seconds, stacks, spans))
+        if path:
+            await client.send_document(target_chat, path, caption="Flamegraph input (folded stacks)")
+    except Exception as e:
+        logger.error(f"Failed to send profile: {e}")
+
+# Trace recording
+class TraceWriter:
+    """Appends JSON lines to size-rotated trace files, keeping the newest TRACE_MAX_FILES"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.file = None
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+        self._rotate()
+
+    def _rotate(self):
+        if self.file:
+            self.file.close()
+        path = os.path.join(self.directory, f"trace-{datetime.utcnow():%Y%m%d-%H%M%S-%f}.jsonl")
+        # Line buffered so a killed process loses at most the record being written
+        self.file = open(path, "a", buffering=1)
+        self.written = 0
+
+        traces = sorted(name for name in os.listdir(self.directory) if name.startswith("trace-"))
+        for name in traces[:-TRACE_MAX_FILES]:
+            os.remove(os.path.join(self.directory, name))
+
+    def write(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self.file.write(line)
+        self.written += len(line)
+        if self.written >= TRACE_MAX_BYTES:
+            self._rotate()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+trace_writer = None
+
+def init_trace_recorder():
+    global trace_writer
+    if TRACE_DIR:
+        trace_writer = TraceWriter(TRACE_DIR)
+        logger.info(f"Recording update traces to {TRACE_DIR}")
+
+def hash_id(telegram_id: int):
+    """Anonymize a user or chat id (stable for the lifetime of TRACE_SALT)"""
+    return hashlib.blake2b(f"{TRACE_SALT}:{telegram_id}".encode(), digest_size=6).hexdigest()
+
+def classify_text(text: str):
+    """Reduce message text to a replayable class without keeping its content"""
+    text = (text or "").strip()
+    if text.lstrip("-").isdigit():
+        return "number"
+    if text.isalpha():
+        return f"word:{len(text)}"
+    return f"text:{min(len(text) // 10 * 10, 200)}"
+
+def classify_callback(data: str):
+    """Drop ids from callback data, keeping the action and game type"""
+    if data.startswith("join_game_"):
+        return "join_game"
+    return data
+
+def record_trace(update):
+    """Write one anonymized trace record for an incoming update"""
+    if isinstance(update, CallbackQuery):
+        message = update.message
+        kind, cls = "cb", classify_callback(update.data or "")
+    else:
+        message = update
+        if message.command:
+            kind, cls = "cmd", message.command[0]
+        else:
+            kind, cls = "msg", classify_text(message.text)
+
+    try:
+        trace_writer.write({
+            "t": round(time.time(), 3),
+            "kind": kind,
+            "chat": hash_id(message.chat.id),
+            "chat_type": str(getattr(message.chat.type, "value", message.chat.type)),
+            "thread": get_thread_id(message),
+            "user": hash_id(update.from_user.id) if update.from_user else None,
+            "cls": cls
+        })
+    except Exception as e:
+        logger.error(f"Error recording trace: {e}")
+
+# Handler wrapper
+def handler_entry(func):
+    """Entry point for every handler: drops updates once a drain has started,
+    records traces when enabled and counts running calls so a drain can wait for them"""
+    @functools.wraps(func)
+    async def wrapper(client, update):
+        global inflight_handlers
+        # Nothing may change game state after the drain's final flush
+        if draining:
+            return
+        if trace_writer is not None:
+            record_trace(update)
+        inflight_handlers += 1
+        try:
+            return await func(client, update)
+        finally:
+            inflight_handlers -= 1
+    return wrapper
+
 # Command handlers
 @app.on_message(filters.command("start"))
+@handler_entry
 async def start_command(client: Client, message: Message):
     """Handle /start command"""
     user = message.from_user
@@ -681,25 +1929,14 @@ async def start_command(client: Client, message: Message):
 
     await message.reply(f"Hi {user.mention()}! Use /games to see available games")
 
-    if chat.type == "private":
-        log_msg = f"New user: {user.full_name} ({user.id})"
-    elif chat.type in ["group", "supergroup"]:
-        # Corrected check: compare with None
-        if groups_collection is not None:
-            groups_collection.update_one(
-                {"_id": chat.id},
-                {"$set": {"name": chat.title, "active": True, "last_seen": datetime.utcnow()}},
-                upsert=True
-            )
-        log_msg = f"Bot added to group: {chat.title} ({chat.id})"
-
-    if LOG_CHANNEL_ID and "log_msg" in locals():
-        try:
-            await client.send_message(LOG_CHANNEL_ID, log_msg)
-        except Exception as e:
-            logger.error(f"Failed to send log: {e}")
+    if chat.type == enums.ChatType.PRIVATE:
+        queue_log_event("new_user", f"{user.full_name} ({user.id})")
+    elif chat.type in GROUP_CHAT_TYPES:
+        touch_group(chat.id, chat.title)
+        queue_log_event("group_add", f"{chat.title} ({chat.id})")
 
 @app.on_message(filters.command("games"))
+@handler_entry
 async def games_command(client: Client, message: Message):
     """Handle /games command"""
     keyboard = []
@@ -715,8 +1952,13 @@ async def games_command(client: Client, message: Message):
     )
 
 @app.on_message(filters.command("broadcast") & filters.user(ADMIN_USER_ID))
+@handler_entry
 async def broadcast_command(client: Client, message: Message):
     """Handle /broadcast command (admin only)"""
+    if not mongo_ready:
+        await message.reply("Bot is starting up, try again in a moment")
+        return
+
     if not message.command or len(message.command) < 2:
         await message.reply("Please provide a message")
         return
@@ -726,6 +1968,7 @@ async def broadcast_command(client: Client, message: Message):
 
     # Corrected check: compare with None
     if groups_collection is not None:
+        await flush_group_registry()
         all_groups = groups_collection.find({"active": True})
         for group in all_groups:
             try:
@@ -735,6 +1978,8 @@ async def broadcast_command(client: Client, message: Message):
             except Exception as e:
                 logger.error(f"Broadcast failed for {group['_id']}: {e}")
                 if "chat not found" in str(e).lower():
+                    if group["_id"] in group_registry:
+                        group_registry[group["_id"]]["active"] = False
                     groups_collection.update_one(
                         {"_id": group["_id"]},
                         {"$set": {"active": False}}
@@ -742,7 +1987,31 @@ async def broadcast_command(client: Client, message: Message):
 
     await message.reply(f"Broadcast sent to {sent_count} groups")
 
-@app.on_message(filters.command("endgame") & filters.group)
+@app.on_message(filters.command("profile") & filters.user(ADMIN_USER_ID))
+@handler_entry
+async def profile_command(client: Client, message: Message):
+    """Handle /profile command (admin only)"""
+    global profile_session
+    if profile_session is not None:
+        await message.reply("A profile is already running")
+        return
+
+    seconds = 30
+    if message.command and len(message.command) > 1:
+        try:
+            seconds = int(message.command[1])
+        except ValueError:
+            await message.reply("Usage: /profile <seconds>")
+            return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    # Keep the task referenced so it is not garbage collected mid-profile
+    profile_session = {"started": datetime.utcnow(), "seconds": seconds}
+    profile_session["task"] = asyncio.create_task(run_profile(seconds, client, message.chat.id))
+    await message.reply(f"Profiling for {seconds}s")
+
+@app.on_message(filters.command("endgame") & group_chats)
+@handler_entry
 async def endgame_command(client: Client, message: Message):
     """Handle /endgame command"""
     chat_id = message.chat.id
@@ -752,46 +2021,61 @@ async def endgame_command(client: Client, message: Message):
         await message.reply("Only admins can end games")
         return
 
-    if chat_id in active_games:
-        if active_games[chat_id].get("timer_task"):
-            active_games[chat_id]["timer_task"].cancel()
-        del active_games[chat_id]
-        # Corrected check: compare with None
-        if game_states_collection is not None:
-            game_states_collection.delete_one({"_id": chat_id})
+    game_key = topic_games.get((chat_id, get_thread_id(message)))
+    if game_key:
+        cancel_game_tasks(active_games[game_key])
+        await remove_game(game_key)
         await message.reply("Game ended")
     else:
         await message.reply("No active game")
 
 @app.on_message(filters.command("leaderboard"))
+@handler_entry
 async def leaderboard_command(client: Client, message: Message):
-    """Handle /leaderboard command"""
-    group_id = message.chat.id if message.chat.type in ["group", "supergroup"] else None
+    """Handle /leaderboard command (optionally /leaderboard daily|weekly)"""
+    if not mongo_ready:
+        await message.reply("Bot is starting up, try again in a moment")
+        return
+
+    group_id = message.chat.id if message.chat.type in GROUP_CHAT_TYPES else None
+
+    period = message.command[1].lower() if message.command and len(message.command) > 1 else None
+    if period and period not in LEADERBOARD_WINDOWS:
+        await message.reply("Usage: /leaderboard [daily|weekly]")
+        return
+    window = LEADERBOARD_WINDOWS.get(period)
+    title = f"{period.capitalize()} " if period else ""
 
     if group_id:
-        group_leaders = await get_leaderboard(group_id)
+        group_leaders = await get_leaderboard(group_id, window)
         if group_leaders:
-            response = "**Group Leaderboard:**\n"
+            response = f"**{title}Group Leaderboard:**\n"
             for i, user in enumerate(group_leaders, 1):
-                score = user.get('group_scores', {}).get(str(group_id), 0)
+                score = user.get("score", 0) if window else user.get('group_scores', {}).get(str(group_id), 0)
                 response += f"{i}. {user.get('username', 'Unknown')} - {score} points\n"
         else:
             response = "No group scores yet"
         await message.reply(response)
 
-    world_leaders = await get_leaderboard()
+    world_leaders = await get_leaderboard(window=window)
     if world_leaders:
-        response = "\n**Global Leaderboard:**\n"
+        response = f"\n**{title}Global Leaderboard:**\n"
         for i, user in enumerate(world_leaders, 1):
+            score = user.get("score", 0) if window else user.get('total_score', 0)
             # Corrected f-string syntax here
-            response += f"{i}. {user.get('username', 'Unknown')} - {user.get('total_score', 0)} points\n"
+            response += f"{i}. {user.get('username', 'Unknown')} - {score} points\n"
     else:
         response = "\nNo global scores yet"
     await message.reply(response)
 
 @app.on_message(filters.command("mystats"))
+@handler_entry
 async def mystats_command(client: Client, message: Message):
     """Handle /mystats command"""
+    if not mongo_ready:
+        await message.reply("Bot is starting up, try again in a moment")
+        return
+
     user_id = message.from_user.id
     # Corrected check: compare with None
     if users_collection is None:
@@ -816,9 +2100,9 @@ async def mystats_command(client: Client, message: Message):
 
 # Callback query handler
 @app.on_callback_query()
+@handler_entry
 async def callback_handler(client: Client, query: CallbackQuery):
-    """Handle all callback queries"""
-    await query.answer()
+    """Handle all callback queries; each path answers the query exactly once"""
     chat_id = query.message.chat.id
     user = query.from_user
     data = query.data
@@ -833,6 +2117,7 @@ async def callback_handler(client: Client, query: CallbackQuery):
             "guessing": "Guess the word/phrase from clues.",
             "number_guessing": "Guess the secret number between 1-100."
         }.get(game_type, "No rules available")
+        await query.answer()
 
         keyboard = [[InlineKeyboardButton(
             f"Start {game_name}",
@@ -846,127 +2131,273 @@ async def callback_handler(client: Client, query: CallbackQuery):
 
     elif data.startswith("start_game_"):
         game_type = data.replace("start_game_", "")
+        thread_id = get_thread_id(query.message)
+
+        if not games_resumed:
+            await query.answer("Bot is restarting, try again in a moment", show_alert=True)
+            return
 
-        if chat_id in active_games:
-            await query.edit_message_text("A game is already active")
+        await query.answer()
+        if (chat_id, thread_id) in topic_games:
+            await query.edit_message_text("A game is already active in this topic")
             return
 
-        active_games[chat_id] = {
+        game_key = new_game_key(chat_id, thread_id)
+        register_game(game_key, {
             "game_type": game_type,
             "players": [],
             "status": "waiting_for_players",
             "current_round": 0,
             "timer_task": None,
+            "lobby_message_id": query.message.id,
             "last_activity_time": datetime.utcnow()
-        }
-        await save_game_state(chat_id)
+        })
+        await save_game_state(game_key)
 
-        game_name = next((name for name, code in GAMES_LIST if code == game_type), "Game")
         await query.edit_message_text(
-            f"**{game_name} Starting!**\n\nPlayers:\n",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("Join Game", callback_data=f"join_game_{chat_id}")
-            ]])
+            render_lobby_text(active_games[game_key]),
+            reply_markup=lobby_keyboard(game_key)
         )
 
-        active_games[chat_id]["timer_task"] = asyncio.create_task(
-            start_game_countdown(chat_id, game_type, query.message, client)
+        active_games[game_key]["timer_task"] = asyncio.create_task(
+            start_game_countdown(game_key, game_type, client)
         )
 
     elif data.startswith("join_game_"):
-        game_id = int(data.replace("join_game_", ""))
+        thread_id, _, game_id = data.replace("join_game_", "").partition("_")
+        game_key = (chat_id, int(thread_id), game_id) if thread_id.isdigit() else None
 
-        if game_id not in active_games or active_games[game_id]["status"] != "waiting_for_players":
+        if game_key not in active_games or active_games[game_key]["status"] != "waiting_for_players":
             await query.answer("Cannot join now", show_alert=True)
             return
 
-        player_data = {"user_id": user.id, "username": user.full_name}
-        if player_data not in active_games[game_id]["players"]:
-            active_games[game_id]["players"].append(player_data)
-            await save_game_state(game_id)
-
-            player_list = "\n".join([p["username"] for p in active_games[game_id]["players"]])
-            try:
-                await query.edit_message_text(
-                    f"**{next((name for name, code in GAMES_LIST if code == active_games[game_id]['game_type']), 'Game')} Starting!**\n\nPlayers:\n{player_list}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("Join Game", callback_data=f"join_game_{game_id}")
-                    ]])
-                )
-            except:
-                await client.send_message(
-                    chat_id=game_id,
-                    text=f"{user.full_name} joined! Players: {len(active_games[game_id]['players'])}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("Join Game", callback_data=f"join_game_{game_id}")
-                    ]])
-                )
-            await query.answer("You joined the game!")
-        else:
+        lobby = get_lobby(game_key)
+        if user.id in lobby["members"]:
             await query.answer("You already joined", show_alert=True)
+            return
+        if len(lobby["members"]) >= LOBBY_MAX_PLAYERS:
+            await query.answer("This game is full", show_alert=True)
+            return
+
+        lobby["members"].add(user.id)
+        active_games[game_key]["players"].append({"user_id": user.id, "username": user.full_name})
+        schedule_lobby_update(game_key, client)
+        schedule_game_save(game_key)
+        await query.answer("You joined the game!")
+
+    else:
+        await query.answer()
 
 # Message handler for game answers
-@app.on_message(filters.text & filters.group & ~filters.regex(r"^\/"))
+@app.on_message(filters.text & group_chats & ~filters.regex(r"^\/"))
+@handler_entry
 async def handle_game_answers(client: Client, message: Message):
     """Handle all game answer messages"""
     chat_id = message.chat.id
-    game_state = active_games.get(chat_id)
+    touch_group(chat_id, message.chat.title)
+    game_key = topic_games.get((chat_id, get_thread_id(message)))
+    game_state = active_games.get(game_key)
 
     if game_state and game_state["status"] == "in_progress":
+        if not message.from_user or not allow_answer(chat_id, message.from_user.id):
+            return
+
         if game_state["game_type"] == "quiz":
-            await handle_quiz_answer_text(message, client)
+            await handle_quiz_answer_text(message, client, game_key)
         elif game_state["game_type"] == "wordchain":
-            await handle_wordchain_answer(message, client)
+            await handle_wordchain_answer(message, client, game_key)
         elif game_state["game_type"] == "guessing":
-            await handle_guessing_answer(message, client)
+            await handle_guessing_answer(message, client, game_key)
         elif game_state["game_type"] == "number_guessing":
-            await handle_number_guess(message, client)
+            await handle_number_guess(message, client, game_key)
 
 # Flask server
 def run_flask_server(): # Renamed to avoid confusion with the flask_app variable
     """Run Flask server in a thread"""
     PORT = int(os.environ.get('PORT', 8080)) # Use environment variable for port, default to 8080
+    flask_app = create_flask_app()
     logger.info(f"Flask server starting on port {PORT}")
     flask_app.run(host="0.0.0.0", port=PORT, debug=False) # Set debug to False for production
 
-# Main function
-async def main():
-    """Start the bot"""
-    init_mongo()
-    await load_game_states()
+# Startup pipeline
+def record_startup_stage(name: str, started: float):
+    """Add a finished stage to the startup timeline"""
+    startup_timeline.append({
+        "stage": name,
+        "start_ms": round((started - process_started) * 1000),
+        "duration_ms": round((time.perf_counter() - started) * 1000)
+    })
 
-    # Start Flask server in a separate thread
-    flask_server_thread = Thread(target=run_flask_server)
-    flask_server_thread.daemon = True # Allows the main program to exit even if the thread is still running
-    flask_server_thread.start()
-    logger.info("Flask server thread started.")
+async def run_startup_stage(name: str, awaitable):
+    """Await a startup stage and record how long it took"""
+    started = time.perf_counter()
+    result = await awaitable
+    record_startup_stage(name, started)
+    return result
+
+def log_startup_timeline():
+    """Log each startup stage's offset and duration"""
+    breakdown = ", ".join(
+        f"{stage['stage']} +{stage['start_ms']}ms ({stage['duration_ms']}ms)" for stage in startup_timeline
+    )
+    logger.info(f"Startup timeline: {breakdown}")
 
-    await app.start()
-    logger.info("Bot started successfully")
+async def start_serving():
+    """Start Pyrogram, which begins dispatching updates as soon as it returns"""
+    await run_startup_stage("pyrogram", app.start())
+    record_startup_stage("serving", process_started)
+
+async def resume_games(client: Client):
+    """Load saved games and restart the timers of interrupted ones"""
+    global games_resumed
+    await load_game_states()
 
-    # Restart any interrupted games
-    for chat_id, game_state in active_games.items():
-        if game_state["status"] == "in_progress":
-            logger.info(f"Restarting game in chat {chat_id}")
+    # Restart any interrupted games, continuing timers from their saved deadlines
+    for game_key, game_state in active_games.items():
+        remaining = remaining_timer_delay(game_state)
+        if game_state["status"] == "waiting_for_players":
+            logger.info(f"Resuming lobby {game_key}")
+            game_state["timer_task"] = asyncio.create_task(start_game_countdown(
+                game_key, game_state["game_type"], client,
+                LOBBY_COUNTDOWN_SECONDS if remaining is None else remaining
+            ))
+        elif game_state["status"] == "in_progress":
+            logger.info(f"Restarting game {game_key}")
             if game_state["game_type"] == "quiz":
                 game_state["timer_task"] = asyncio.create_task(
-                    send_next_quiz_question(chat_id, app)
+                    send_next_quiz_question(game_key, client, remaining)
                 )
             elif game_state["game_type"] == "wordchain":
                 game_state["timer_task"] = asyncio.create_task(
-                    turn_timer(chat_id, 60, app, "wordchain")
+                    turn_timer(game_key, 60, client, "wordchain", remaining)
                 )
             elif game_state["game_type"] == "guessing":
-                game_state["timer_task"] = asyncio.create_task(
-                    send_next_guess_item(chat_id, app)
-                )
+                if remaining is None:
+                    game_state["timer_task"] = asyncio.create_task(
+                        send_next_guess_item(game_key, client)
+                    )
+                else:
+                    game_state["timer_task"] = asyncio.create_task(
+                        turn_timer(game_key, 60, client, "guessing", remaining)
+                    )
             elif game_state["game_type"] == "number_guessing":
                 game_state["timer_task"] = asyncio.create_task(
-                    auto_end_game(chat_id, app)
+                    auto_end_game(game_key, client)
                 )
+            if game_state["game_type"] != "number_guessing":
+                game_state["inactivity_task"] = asyncio.create_task(
+                    auto_end_game(game_key, client)
+                )
+    games_resumed = True
+
+# Shutdown drain
+async def flush_all_game_states():
+    """Write every active game to the state store in one batch"""
+    if state_store is None or not active_games:
+        return
+
+    now = datetime.utcnow()
+    snapshots = {}
+    for game_key in active_games:
+        snapshot = snapshots[game_key] = game_state_snapshot(game_key)
+        deadline = snapshot.get("timer_deadline")
+        if deadline is not None:
+            # Tied to this deadline so it is ignored once a resumed timer sets a new one
+            snapshot["timer_paused"] = {
+                "deadline": deadline,
+                "remaining": max(0.0, (deadline - now).total_seconds())
+            }
+
+    try:
+        await state_store.save_many(snapshots)
+        logger.info(f"Flushed {len(active_games)} game states")
+    except Exception as e:
+        logger.error(f"Error flushing game states: {e}")
+
+async def drain():
+    """Stop taking updates, let running handlers finish, cancel timers, then
+    checkpoint all games"""
+    global draining
+    draining = True
+    logger.info("Draining: incoming updates are dropped")
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while inflight_handlers and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if inflight_handlers:
+        logger.warning(f"Drain timeout reached with {inflight_handlers} handlers still running")
+
+    # Timer deadlines stay in the game states so the next instance resumes them
+    tasks = []
+    for game_state in active_games.values():
+        tasks.extend(cancel_game_tasks(game_state))
+    for game_key in list(lobbies):
+        close_lobby(game_key)
+    for task in pending_saves.values():
+        task.cancel()
+        tasks.append(task)
+    pending_saves.clear()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    await flush_all_game_states()
+
+async def warm_content_cache():
+    """Preload channel content for every content-based game"""
+    for game_type in CONTENT_GAME_TYPES:
+        await get_channel_content(game_type)
+
+# Main function
+async def main():
+    """Start the bot"""
+    record_startup_stage("imports", process_started)
+    init_state_store()
+    init_trace_recorder()
+
+    # Start Flask server in a separate thread
+    flask_server_thread = Thread(target=run_flask_server)
+    flask_server_thread.daemon = True # Allows the main program to exit even if the thread is still running
+    flask_server_thread.start()
+    logger.info("Flask server thread started.")
+
+    # Mongo connect (blocking, so run in a thread) overlaps with the Telegram login
+    await asyncio.gather(
+        run_startup_stage("mongo", asyncio.to_thread(init_mongo)),
+        start_serving()
+    )
+    logger.info("Bot started successfully")
+
+    log_forwarder_task = None
+    if LOG_CHANNEL_ID:
+        log_forwarder_task = asyncio.create_task(log_forwarder(app))
+    group_registry_task = asyncio.create_task(group_registry_flusher())
+    score_event_task = asyncio.create_task(score_event_flusher())
+    throttle_task = asyncio.create_task(throttle_pruner())
+    consumers_stop_event = Event()
+    consumer_threads = []
+    if SCORE_EVENT_CONSUMERS:
+        consumer_threads = start_score_event_consumers(consumers_stop_event)
+
+    # Deferred until the bot is already answering
+    await run_startup_stage("resume_games", resume_games(app))
+    await run_startup_stage("content_warmup", warm_content_cache())
+    log_startup_timeline()
 
     await idle()
+    await drain()
+    group_registry_task.cancel()
+    await flush_group_registry()
+    score_event_task.cancel()
+    throttle_task.cancel()
+    await asyncio.gather(*score_flush_tasks)
+    await flush_score_events()
+    await asyncio.to_thread(stop_score_event_consumers, consumers_stop_event, consumer_threads)
+    if log_forwarder_task:
+        log_forwarder_task.cancel()
+        await flush_log_events(app)
     await app.stop()
+    await state_store.close()
+    if trace_writer:
+        trace_writer.close()
     if mongo_client:
         mongo_client.close() # Close MongoDB connection on bot stop
         logger.info("MongoDB connection closed.")
@@ -0,0 +1,223 @@
+"""Replay a recorded update trace against the bot's handlers offline.
+
+Traces are written by the bot when TRACE_DIR is set. Replay runs every
+recorded update through the real handlers with an in-memory state store, a
+fake Telegram client and synthetic game content, then reports handler
+latency and outgoing API call counts so two builds can be compared.
+
+Usage: python replay_trace.py TRACE_FILE [TRACE_FILE ...] [--speed N] [--wait S]
+
+Game timers (lobby countdowns, round timers) run in real time, so replaying
+faster than --speed 1 drops answers that were recorded after a game started.
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+from collections import Counter, defaultdict
+
+import bot
+
+# Synthetic content so games can start without MongoDB
+SYNTHETIC_CONTENT = {
+    "quiz": [{"text": f"Question {i}?", "answer": f"answer{i}"} for i in range(50)],
+    "wordchain": [{"question": word} for word in ("apple", "tiger", "river", "lemon", "night")],
+    "guessing": [{"question": f"clue {i}", "answer": f"thing{i}"} for i in range(50)],
+}
+
+# Fake Telegram objects
+class FakeUser:
+    def __init__(self, user_hash: str):
+        self.id = int(user_hash, 16) if user_hash else 0
+        self.full_name = f"user-{user_hash}"
+
+    def mention(self):
+        return self.full_name
+
+class FakeChat:
+    def __init__(self, chat_id: int, chat_type: str):
+        self.id = chat_id
+        self.type = bot.enums.ChatType(chat_type)
+        self.title = f"chat {chat_id}"
+
+class FakeMessage:
+    def __init__(self, client, chat: FakeChat, user: FakeUser, thread_id: int, text: str = None, command: list = None):
+        self._client = client
+        self.id = client.next_message_id()
+        self.chat = chat
+        self.from_user = user
+        self.message_thread_id = thread_id or None
+        self.is_topic_message = bool(thread_id)
+        self.text = text
+        self.command = command
+
+    async def reply(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+
+class FakeCallbackQuery:
+    def __init__(self, client, message: FakeMessage, user: FakeUser, data: str):
+        self._client = client
+        self.message = message
+        self.from_user = user
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        self._client.calls["answer_callback_query"] += 1
+
+    async def edit_message_text(self, text, **kwargs):
+        return await self._client.edit_message_text(self.message.chat.id, self.message.id, text, **kwargs)
+
+class FakeChatMember:
+    status = bot.enums.ChatMemberStatus.ADMINISTRATOR
+
+class FakeClient:
+    """Counts outgoing API calls instead of sending them"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.message_id = 0
+        self.chats = {}
+
+    def next_message_id(self):
+        self.message_id += 1
+        return self.message_id
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls["send_message"] += 1
+        return FakeMessage(self, self.chats.get(chat_id) or FakeChat(chat_id, "private"), None, 0, text)
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.calls["edit_message_text"] += 1
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.calls["send_document"] += 1
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls["get_chat_member"] += 1
+        return FakeChatMember()
+
+def chat_id_for(record: dict):
+    """Stable numeric chat id for a hashed chat; groups get negative ids like Telegram's"""
+    chat_id = int(record["chat"], 16)
+    return chat_id if record["chat_type"] == "private" else -chat_id
+
+def load_trace(paths: list):
+    """Read trace records from one or more files, ordered by time"""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record["t"])
+    return records
+
+def synthesize_text(cls: str):
+    """Build message text matching a recorded text class"""
+    if cls == "number":
+        return str(random.randint(1, 100))
+    kind, _, length = cls.partition(":")
+    length = max(int(length or 1), 1)
+    if kind == "word":
+        return "".join(random.choices(string.ascii_lowercase, k=length))
+    return " ".join("".join(random.choices(string.ascii_lowercase, k=9)) for _ in range(max(length // 10, 1)))
+
+def callback_data(record: dict):
+    """Rebuild callback data; joins target whichever game is open in the topic"""
+    if record["cls"] != "join_game":
+        return record["cls"]
+    game_key = bot.topic_games.get((chat_id_for(record), record["thread"] or 0))
+    if game_key is None:
+        return "join_game_0_missing"
+    return f"join_game_{game_key[1]}_{game_key[2]}"
+
+COMMAND_HANDLERS = {
+    "start": bot.start_command,
+    "games": bot.games_command,
+    "endgame": bot.endgame_command,
+    "leaderboard": bot.leaderboard_command,
+    "mystats": bot.mystats_command,
+}
+
+async def replay(records: list, speed: float, wait: float):
+    client = FakeClient()
+    latencies = defaultdict(list)
+    events = Counter()
+
+    started = time.monotonic()
+    trace_start = records[0]["t"] if records else 0
+    for record in records:
+        if speed > 0:
+            delay = (record["t"] - trace_start) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        chat_id = chat_id_for(record)
+        chat = client.chats.setdefault(chat_id, FakeChat(chat_id, record["chat_type"]))
+        user = FakeUser(record["user"])
+        kind = record["kind"]
+
+        if kind == "cmd":
+            handler = COMMAND_HANDLERS.get(record["cls"])
+            if handler is None:
+                events["skipped"] += 1
+                continue
+            update = FakeMessage(client, chat, user, record["thread"], f"/{record['cls']}", [record["cls"]])
+        elif kind == "cb":
+            handler = bot.callback_handler
+            message = FakeMessage(client, chat, None, record["thread"])
+            update = FakeCallbackQuery(client, message, user, callback_data(record))
+        else:
+            if chat.type not in bot.GROUP_CHAT_TYPES:
+                events["skipped"] += 1
+                continue
+            handler = bot.handle_game_answers
+            update = FakeMessage(client, chat, user, record["thread"], synthesize_text(record["cls"]))
+
+        handler_started = time.perf_counter()
+        await handler(client, update)
+        latencies[kind].append(time.perf_counter() - handler_started)
+        events[kind] += 1
+
+    if wait > 0:
+        await asyncio.sleep(wait)
+    await bot.drain()
+    return events, latencies, client.calls
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def report(events: Counter, latencies: dict, calls: Counter, elapsed: float):
+    print(f"Replayed {sum(events.values()) - events['skipped']} updates in {elapsed:.2f}s ({events['skipped']} skipped)")
+    for kind, values in sorted(latencies.items()):
+        print(
+            f"  {kind:>4}: n={len(values)} p50={percentile(values, 0.5) * 1000:.2f}ms "
+            f"p95={percentile(values, 0.95) * 1000:.2f}ms max={max(values) * 1000:.2f}ms"
+        )
+    print("API calls: " + ", ".join(f"{name}={count}" for name, count in sorted(calls.items())))
+    print("Throttle: " + ", ".join(f"{name}={count}" for name, count in sorted(bot.throttle_stats.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded bot traces offline")
+    parser.add_argument("traces", nargs="+", help="trace-*.jsonl files written with TRACE_DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument("--wait", type=float, default=0.0, help="seconds to let game timers run after the last update")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for synthesized answers")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    bot.state_store = bot.MemoryStateStore()
+    bot.games_resumed = True
+    bot.mongo_ready = True
+    now = time.monotonic()
+    for game_type, content in SYNTHETIC_CONTENT.items():
+        bot.content_cache[game_type] = (now + 10 ** 9, content)
+
+    records = load_trace(args.traces)
+    started = time.monotonic()
+    events, latencies, calls = asyncio.run(replay(records, args.speed, args.wait))
+    report(events, latencies, calls, time.monotonic() - started)
+
+if __name__ == "__main__":
+    main()
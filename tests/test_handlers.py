@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from pyrogram import enums
+from pyrogram.types import CallbackQuery, Chat, Message, User
+
+import bot
+
+class RecordingClient:
+    """Stands in for pyrogram.Client as the target of Message.reply"""
+
+    parse_mode = enums.ParseMode.DEFAULT
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, **kwargs):
+        self.sent.append(kwargs)
+
+    async def answer_callback_query(self, **kwargs):
+        pass
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    monkeypatch.setattr(bot, "LOG_CHANNEL_ID", -100999)
+    bot.log_events.clear()
+    bot.group_registry.clear()
+    bot.dirty_groups.clear()
+    bot.active_games.clear()
+    bot.topic_games.clear()
+    monkeypatch.setattr(bot, "state_store", bot.MemoryStateStore())
+    monkeypatch.setattr(bot, "games_resumed", True)
+
+def make_message(client, chat: Chat, text: str, **kwargs):
+    return Message(
+        client=client,
+        id=10,
+        chat=chat,
+        from_user=User(client=client, id=1, first_name="Ann"),
+        text=text,
+        command=text.lstrip("/").split() if text.startswith("/") else None,
+        **kwargs
+    )
+
+def test_start_in_private_chat_queues_new_user():
+    client = RecordingClient()
+    chat = Chat(id=1, type=enums.ChatType.PRIVATE)
+    asyncio.run(bot.start_command(client, make_message(client, chat, "/start")))
+
+    assert [kind for kind, _ in bot.log_events] == ["new_user"]
+    assert len(client.sent) == 1
+
+def test_start_in_supergroup_queues_group_add_and_touches_group():
+    client = RecordingClient()
+    chat = Chat(id=-1001, type=enums.ChatType.SUPERGROUP, title="Quiz night")
+    asyncio.run(bot.start_command(client, make_message(client, chat, "/start")))
+
+    assert [kind for kind, _ in bot.log_events] == ["group_add"]
+    assert bot.group_registry[-1001]["name"] == "Quiz night"
+
+def forum_message(client, **kwargs):
+    return make_message(client, Chat(id=-1002, type=enums.ChatType.FORUM, title="Forum"), "hi", **kwargs)
+
+def test_topic_message_resolves_to_its_topic():
+    message = forum_message(None, message_thread_id=7, is_topic_message=True, reply_to_message_id=7)
+    assert bot.get_thread_id(message) == 7
+
+def test_general_topic_and_plain_groups_resolve_to_thread_zero():
+    general = forum_message(None, message_thread_id=bot.GENERAL_TOPIC_ID, is_topic_message=True)
+    # A quoted reply in a normal supergroup must not be mistaken for a topic
+    reply = make_message(None, Chat(id=-1001, type=enums.ChatType.SUPERGROUP), "hi", reply_to_message_id=55)
+    assert bot.get_thread_id(general) == 0
+    assert bot.get_thread_id(reply) == 0
+
+def test_group_filter_accepts_forum_chats():
+    client = RecordingClient()
+    assert bot.group_chats(client, forum_message(client))
+
+def test_games_run_in_parallel_in_different_topics():
+    client = RecordingClient()
+
+    async def scenario():
+        for thread_id in (7, 9):
+            lobby = forum_message(client, message_thread_id=thread_id, is_topic_message=True)
+            query = CallbackQuery(
+                client=client, id=str(thread_id), from_user=lobby.from_user,
+                chat_instance="1", message=lobby, data="start_game_number_guessing"
+            )
+            await bot.callback_handler(client, query)
+        for game_key in list(bot.active_games):
+            bot.cancel_game_tasks(bot.active_games[game_key])
+
+    asyncio.run(scenario())
+    assert sorted(bot.topic_games) == [(-1002, 7), (-1002, 9)]
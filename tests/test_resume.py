@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+
+GAME_KEY = (-1001, 0, "abcd1234")
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    bot.active_games.clear()
+    bot.topic_games.clear()
+    monkeypatch.setattr(bot, "state_store", bot.MemoryStateStore())
+    monkeypatch.setattr(bot, "games_resumed", False)
+
+def wordchain_state(deadline: datetime):
+    return {
+        "game_type": "wordchain",
+        "status": "in_progress",
+        "players": [{"user_id": i, "username": name} for i, name in enumerate("ABC")],
+        "turn_index": 0,
+        "current_word": "apple",
+        "used_words": ["apple"],
+        "timer_deadline": deadline,
+        "last_activity_time": datetime.utcnow(),
+    }
+
+def test_drain_flush_records_remaining_seconds():
+    bot.register_game(GAME_KEY, wordchain_state(datetime.utcnow() + timedelta(seconds=20)))
+    asyncio.run(bot.flush_all_game_states())
+
+    paused = bot.state_store.snapshots[GAME_KEY]["timer_paused"]
+    assert 19 < paused["remaining"] <= 20
+
+def test_downtime_does_not_count_against_a_paused_timer():
+    deadline = datetime.utcnow() - timedelta(minutes=5)
+    state = wordchain_state(deadline)
+    state["timer_paused"] = {"deadline": deadline, "remaining": 12.5}
+    assert bot.remaining_timer_delay(state) == 12.5
+
+    # A timer started after the resume replaces the deadline, so the pause no longer applies
+    state["timer_deadline"] = datetime.utcnow() - timedelta(seconds=1)
+    assert bot.remaining_timer_delay(state) == 0.0
+
+def test_resumed_turn_keeps_the_current_player():
+    deadline = datetime.utcnow() - timedelta(minutes=5)
+    snapshot = wordchain_state(deadline)
+    snapshot["players"] = bot.pack_players(snapshot["players"])
+    snapshot["timer_paused"] = {"deadline": deadline, "remaining": 30.0}
+    bot.state_store.snapshots[GAME_KEY] = snapshot
+
+    async def scenario():
+        await bot.resume_games(client=None)
+        await asyncio.sleep(0.05)
+        game_state = bot.active_games[GAME_KEY]
+        bot.cancel_game_tasks(game_state)
+        return game_state
+
+    game_state = asyncio.run(scenario())
+    assert [p["username"] for p in game_state["players"]] == ["A", "B", "C"]
+    assert 29 < (game_state["timer_deadline"] - datetime.utcnow()).total_seconds() <= 30
@@ -0,0 +1,118 @@
+import asyncio
+import warnings
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import bot
+
+GAME_KEY = (-1001234567890, 42, "a1b2c3")
+
+def make_state():
+    now = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    return {
+        "game_type": "quiz",
+        "status": "in_progress",
+        "players": [{"user_id": 1, "username": "Ann"}],
+        "current_round": 2,
+        "timer_deadline": now + timedelta(seconds=30),
+        "last_activity_time": now,
+    }
+
+class CountingPipeline:
+    """Wraps a fakeredis pipeline and records the commands queued on it"""
+
+    def __init__(self, pipe, commands):
+        self.pipe = pipe
+        self.commands = commands
+
+    def __getattr__(self, name):
+        method = getattr(self.pipe, name)
+        if name == "execute":
+            return method
+
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return method(*args, **kwargs)
+        return queue
+
+@pytest.fixture
+def store():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    store = bot.RedisStateStore(client)
+    store.commands = []
+    pipeline = client.pipeline
+    client.pipeline = lambda **kwargs: CountingPipeline(pipeline(**kwargs), store.commands)
+    return store
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_round_trip_keeps_datetimes_and_negative_chat_ids(store):
+    state = make_state()
+
+    async def scenario():
+        await store.save(GAME_KEY, state)
+        return await bot.RedisStateStore(store.client).load_all()
+
+    assert run(scenario()) == {GAME_KEY: state}
+
+def test_only_changed_fields_are_written(store):
+    state = make_state()
+
+    async def scenario():
+        await store.save(GAME_KEY, state)
+        store.commands.clear()
+
+        await store.save(GAME_KEY, dict(state))
+        unchanged = list(store.commands)
+
+        await store.save(GAME_KEY, dict(state, current_round=3))
+        return unchanged, list(store.commands)
+
+    unchanged, changed = run(scenario())
+    assert unchanged == []
+    hsets = [kwargs["mapping"] for name, args, kwargs in changed if name == "hset"]
+    assert hsets == [{"current_round": "3"}]
+
+def test_removed_fields_are_deleted(store):
+    state = make_state()
+
+    async def scenario():
+        await store.save(GAME_KEY, state)
+        trimmed = dict(state)
+        trimmed.pop("timer_deadline")
+        await store.save(GAME_KEY, trimmed)
+        return trimmed, await bot.RedisStateStore(store.client).load_all()
+
+    trimmed, loaded = run(scenario())
+    assert loaded == {GAME_KEY: trimmed}
+
+def test_delete_removes_game_and_index_entry(store):
+    async def scenario():
+        await store.save(GAME_KEY, make_state())
+        await store.save((5, 0, "other"), make_state())
+        await store.delete(GAME_KEY)
+        return await store.load_all(), await store.client.smembers(store.index_key)
+
+    loaded, index = run(scenario())
+    assert list(loaded) == [(5, 0, "other")]
+    assert index == {store._key((5, 0, "other"))}
+
+def test_save_after_load_all_skips_unchanged_games(store):
+    async def scenario():
+        await store.save(GAME_KEY, make_state())
+        reloaded = bot.RedisStateStore(store.client)
+        games = await reloaded.load_all()
+        store.commands.clear()
+        await reloaded.save_many(games)
+        return list(store.commands)
+
+    assert run(scenario()) == []
+
+def test_close_does_not_use_deprecated_client_close(store):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        run(store.close())